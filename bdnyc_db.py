@@ -0,0 +1,340 @@
+'''
+Shared access to the BDNYC database. The pickled database is loaded once per process and kept in memory; it is only loaded again when the file changes on disk (its modification time changes). get_spec, used by compare_spec.py and compare_templ.py, pulls spectra from it.
+
+convert_db writes the database, once, to an indexed store: a folder with an SQLite table of targets and spectra (index.sqlite) plus one .npy file per spectrum. With STORE_DIR set to that folder, get_spec reads from the store instead, touching only the rows and the (memory-mapped) spectrum it needs, so it no longer unpickles the whole database.
+
+Spectra are found through the SpeX Prism index (spex_index, lookup_spex), built once over the whole database or store: it maps each U-number to the id, instrument, resolution, coordinates and spectral type of its SpeX Prism spectrum.
+'''
+
+import collections
+import numpy as np
+import os
+import threading
+
+import spectools
+
+FOLDER_DB = '/Users/alejo/Dropbox/Python/Python_Database/'
+FILE_DB = 'BDNYCData.txt'
+STORE_DIR = None # Folder of the indexed store written by convert_db (None: use the pickled database)
+STORE_INDEX = 'index.sqlite'
+REGIMES = ['nir','opt','mir']
+RESOLUTIONS = ['low','med','high']
+
+_db = None
+_dbPath = None
+_dbMtime = None
+_dbLock = threading.Lock()
+
+SpexEntry = collections.namedtuple('SpexEntry', 'spec_id instrument res coord sptype file')
+SpecResult = collections.namedtuple('SpecResult', 'unum status spec coord sptype')
+_index = {}
+_indexLock = threading.Lock()
+
+
+def load_db(path=None):
+    '''
+    This function returns the BDNYC database object. It is unpickled the first time it is requested and then reused, unless the database file has been modified since.
+
+    *path*
+      String with the full path of the pickled database (default: FOLDER_DB + FILE_DB)
+    '''
+
+    global _db, _dbPath, _dbMtime
+
+    import pickle
+    import BDNYC
+
+    if path is None:
+        path = FOLDER_DB + FILE_DB
+
+    with _dbLock:
+        mtime = os.path.getmtime(path)
+        if _db is None or path != _dbPath or mtime != _dbMtime:
+            f = open(path,'rb')
+            _db = pickle.load(f)
+            f.close()
+            _dbPath = path
+            _dbMtime = mtime
+        return _db
+
+
+def _open_store(folder, create=False):
+    # Connection to the index of a store, creating its tables if requested
+    import sqlite3
+
+    conn = sqlite3.connect(os.path.join(folder, STORE_INDEX))
+    conn.text_factory = str # Byte strings in and out, like in the pickled database (e.g. utf-8 spectral types with gamma or beta)
+    if create:
+        conn.execute('CREATE TABLE IF NOT EXISTS targets (unum TEXT PRIMARY KEY, sptype TEXT, ra TEXT, dec TEXT)')
+        conn.execute('CREATE TABLE IF NOT EXISTS spectra (unum TEXT, spec_id INTEGER, row_order INTEGER, ' \
+                     'instrument TEXT, regime TEXT, res TEXT, file TEXT, PRIMARY KEY (unum, spec_id))')
+    return conn
+
+
+def convert_db(folder, unums=None, path=None):
+    '''
+    This function writes the BDNYC database to an indexed store in *folder*: the SQLite file STORE_INDEX with a table of targets (U-number, spectral type, RA, Dec) and a table of spectra (U-number, spectrum id, instrument, regime, resolution, file), and one .npy file per spectrum. It only needs to be run once, or again when the database changes.
+
+    *folder*
+      String with the folder of the store (created if it does not exist)
+    *unums*
+      List with the U-numbers to convert (default: all targets in the database)
+    *path*
+      String with the full path of the pickled database (default: FOLDER_DB + FILE_DB)
+    '''
+
+    # 1. Load database ----------------------------------------------
+    bdnyc = load_db(path)
+    if unums is None:
+        unums = [target.unum for target in bdnyc.targets]
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    # 2. Write targets and spectra ----------------------------------
+    conn = _open_store(folder, create=True)
+    with conn:
+        for unum in unums:
+            availData = bdnyc.show_data(unum, dump=True)
+            if availData is None:
+                continue
+            conn.execute('INSERT OR REPLACE INTO targets VALUES (?, ?, ?, ?)', \
+                         (unum, availData[3][1], availData[4][1], availData[5][1]))
+
+            order = 0
+            for row in availData:
+                # Check that row is data row
+                try:
+                    row[0] + 1
+                except TypeError:
+                    continue
+                regime = [rg for rg in REGIMES if rg in row]
+                res = [rs for rs in RESOLUTIONS if rs in row]
+                spec = bdnyc.get_data(unum, row[0])
+                if spec is None:
+                    continue
+                fileNm = '%s_%d.npy' % (unum, row[0])
+                np.save(os.path.join(folder, fileNm), np.asarray(spec, dtype=float))
+                conn.execute('INSERT OR REPLACE INTO spectra VALUES (?, ?, ?, ?, ?, ?, ?)', \
+                             (unum, row[0], order, row[3], ''.join(regime[:1]), ''.join(res[:1]), fileNm))
+                order = order + 1
+    conn.close()
+
+
+def _spex_row(availData):
+    # Data row of the first low-res, NIR SpeX Prism spectrum among the rows of data available for a target, or None
+    for row in availData:
+        # Check that row is data row
+        try:
+            row[0] + 1
+        except TypeError:
+            continue
+        # Check that row is nir row
+        try:
+            loc = row.index('nir')
+        except ValueError:
+            continue
+        # Check that row is low res row
+        try:
+            loc = row.index('low')
+        except ValueError:
+            continue
+        # Check that row is Spex Prism row
+        instr = row[3].lower()
+        loc = instr.find('spex')
+        if loc != -1:
+            return row
+    return None
+
+
+def _coord(ra, dec):
+    # Short coordinates designation (e.g. 1234+1234) from RA and Dec strings
+    coord = ra[0:5] + dec[0:6]
+    return coord.replace(' ','')
+
+
+def _text(value):
+    # String read from the store, with '' for NULL
+    if value is None:
+        return ''
+    return str(value)
+
+
+def _build_index(store):
+    # SpeX Prism index of the database, or of a store if *store* is given
+    index = {}
+    if store is None:
+        bdnyc = load_db()
+        for target in bdnyc.targets:
+            availData = bdnyc.show_data(target.unum, dump=True)
+            if availData is None:
+                continue
+            row = _spex_row(availData)
+            if row is None:
+                index[target.unum] = None
+            else:
+                index[target.unum] = SpexEntry(row[0], row[3], 'low', \
+                                               _coord(_text(availData[4][1]), _text(availData[5][1])), \
+                                               _text(availData[3][1]), None)
+    else:
+        conn = _open_store(store)
+        try:
+            for unum, ra, dec, st in conn.execute('SELECT unum, ra, dec, sptype FROM targets'):
+                index[str(unum)] = None
+            rows = conn.execute("SELECT s.unum, s.spec_id, s.instrument, s.res, t.ra, t.dec, t.sptype, s.file " \
+                                "FROM spectra s JOIN targets t ON s.unum = t.unum WHERE s.regime = 'nir' AND " \
+                                "s.res = 'low' AND lower(s.instrument) LIKE '%spex%' ORDER BY s.row_order DESC")
+            for unum, specId, instr, res, ra, dec, st, fileNm in rows:
+                # Rows come last to first, so the first SpeX row of each target is the one kept
+                index[str(unum)] = SpexEntry(specId, _text(instr), _text(res), _coord(_text(ra), _text(dec)), \
+                                             _text(st), os.path.join(store, fileNm))
+        finally:
+            conn.close()
+    return index
+
+
+def spex_index(store=None):
+    '''
+    This function returns the SpeX Prism index: a dictionary that maps the U-number of every target to a SpexEntry (spec_id, instrument, res, coord, sptype, file) describing its low-res, NIR SpeX Prism spectrum, or to None if it has none. It is built once, with a single pass over the database (or over the store written by convert_db), and built again only when the database (or the store index) changes.
+
+    *store*
+      String with the folder of an indexed store to index (default: STORE_DIR; if None, the pickled database is used)
+    '''
+
+    if store is None:
+        store = STORE_DIR
+    if store is None:
+        source = ('db', id(load_db()))
+    else:
+        source = ('store', store, os.path.getmtime(os.path.join(store, STORE_INDEX)))
+
+    with _indexLock:
+        if source not in _index:
+            _index.clear()
+            _index[source] = _build_index(store)
+        return _index[source]
+
+
+def lookup_spex(unum, store=None):
+    '''
+    This function returns the SpexEntry of a target (see spex_index), None if the target has no SpeX Prism spectrum, or raises KeyError if the target is not in the database.
+
+    *unum*
+      String with the U-number of the target (e.g. U20268).
+    *store*
+      Same as in spex_index.
+    '''
+
+    return spex_index(store)[unum]
+
+
+def _fetch_spec(unum, separate, bandnames, bandlimits, bandnorms, index):
+    # Spectrum of one target (split and normalized by bands if separate) and its [coord, sptype], with a status:
+    # 'ok', 'unknown' (target not in the database), 'no_spex' (no SpeX Prism spectrum) or 'range' (empty band)
+    import astrotools as at
+
+    # 1. Find SpeX Prism spectrum in the index ---------------------
+    if unum not in index:
+        return 'unknown', None, None
+    entry = index[unum]
+    if entry is None:
+        return 'no_spex', None, None
+    params = [entry.coord, entry.sptype]
+
+    # 2. Get spectrum (memory-mapped from the store, or from the database)
+    if entry.file is not None:
+        specRaw = np.load(entry.file, mmap_mode='r')
+    else:
+        specRaw = load_db().get_data(unum, entry.spec_id)
+    if not separate:
+        return 'ok', specRaw, params
+
+    # 3. Separate spectrum by bands ---------------------------------
+    spec = [None] * 3
+    for bIdx, band in enumerate(bandnames):
+        bandSl = spectools.band_slice(specRaw[0,:], bandlimits[band])
+        if bandSl.start == bandSl.stop:
+            return 'range', None, params
+        spec[bIdx] = specRaw[:,bandSl]
+
+    # 4. Normalize spectrum -----------------------------------------
+    specNorm = [None] * 3
+    for bIdx, band in enumerate(bandnames):
+        specNorm[bIdx] = at.norm_spec(spec[bIdx], bandnorms[band])[0]
+
+    return 'ok', specNorm, params
+
+
+def get_spec(unum, separate=False, bandnames=None, bandlimits=None, bandnorms=None, retCoord=False, retST=False, store=None):
+    '''
+    This function finds and pulls spectrum from the BDNYC database. Specifically, it looks for low-res, NIR SpeX Prism spectra. It can split and normalize it by the NIR bands (J, H, and K).
+
+    *unum*
+      String with the U-number of the target (e.g. U20268).
+    *separate*
+      Boolean, whether to split and normalize the spectrum by NIR bands (J, H, and K)
+    *bandnames*
+      List with strings containing the band names used to separate the spectrum (when separate=True)
+    *bandlimits*
+      Dictionary with keys *bandnames*, each key containing a list with float numbers specifying the bands limits (e.g. {'J': [0.8,1.4], 'H': [1.4,1.9], 'K': [1.9,2.4]}
+    *bandnorms*
+      Same structure as *bandlimits*, this time the float numbers specify the wavelength ranges used to normalize the bands (when separate=True)
+    *retCoord*
+      Boolean, whether to pull from the database the target coordinates
+    *retST*
+      Boolean, whether to pull from the database the target spectral type
+    *store*
+      String with the folder of an indexed store written by convert_db to read from (default: STORE_DIR; if None, the pickled database is used)
+    '''
+
+    if store is None:
+        store = STORE_DIR
+    status, spec, params = _fetch_spec(unum, separate, bandnames, bandlimits, bandnorms, spex_index(store))
+    if status == 'unknown':
+        return
+    elif status == 'no_spex':
+        print 'Spectrum for target not found.'
+        return
+    elif status == 'range':
+        print 'Error in spectrum range.'
+        return
+
+    # Return target parameters if requested
+    params = [param for param, ret in zip(params, [retCoord, retST]) if ret]
+    if params != []:
+        return spec, params
+    else:
+        return spec
+
+
+def get_specs(unums, separate=False, bandnames=None, bandlimits=None, bandnorms=None, store=None, workers=8):
+    '''
+    This function pulls the spectra of many targets at once (see get_spec), from one database handle and SpeX Prism index, splitting and normalizing them over a pool of threads. It returns a list aligned with *unums*, with one SpecResult (unum, status, spec, coord, sptype) per target, where status is 'ok', 'unknown' (target not in the database), 'no_spex' (no SpeX Prism spectrum) or 'range' (a band with no data); spec is None unless status is 'ok'.
+
+    *unums*
+      List with the U-numbers of the targets.
+    *separate*, *bandnames*, *bandlimits*, *bandnorms*, *store*
+      Same as in get_spec.
+    *workers*
+      Integer with the number of threads.
+    '''
+
+    from multiprocessing.pool import ThreadPool
+
+    if store is None:
+        store = STORE_DIR
+    index = spex_index(store)
+
+    def fetch(unum):
+        status, spec, params = _fetch_spec(unum, separate, bandnames, bandlimits, bandnorms, index)
+        if params is None:
+            params = [None, None]
+        return SpecResult(unum, status, spec, params[0], params[1])
+
+    pool = ThreadPool(max(min(workers, len(unums)), 1))
+    try:
+        results = pool.map(fetch, unums)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
@@ -0,0 +1,211 @@
+'''
+Benchmark of find_rv on synthetic spectra: measures the radial velocity of targets with known injected velocities and
+noise levels in every engine mode, and reports wall time, peak memory, bias and scatter as JSON, so that runs before
+and after a change can be compared.  Needs nothing but numpy and scipy, and runs offline.
+
+Usage:
+    python bench_rv.py                        # all modes, JSON to stdout
+    python bench_rv.py -o before.json -m batch-gauss analytic chi2 --n-iter 200 --trials 10
+
+Every mode runs in its own process, so that its peak memory (resident set size, from resource.getrusage) is not
+mixed with that of the other modes.  A mode that fails is reported with its error instead of stopping the run, and
+values that are not finite (e.g. the bias of a mode where no target was measured) are written as null.
+'''
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import Queue
+import random
+import resource
+import sys
+import time
+import traceback
+
+import numpy
+
+import find_rv
+import spectools
+
+# Synthetic spectra: 1000 pixels (the length the serial engine expects) across the H band at a SpeX cross-dispersed
+# resolution, with random absorption lines
+WV_MIN = 1.50
+WV_MAX = 1.80
+N_PIX = 1000
+RESOLUTION = 2000.
+N_LINES = 120
+STD_SNR = 200.
+VELOCITIES = [-40., 0., 25., 60.]		# injected radial velocities (km/s); the standard is at rest
+SNRS = [20., 50., 100.]
+
+# Engine modes: keyword arguments of find_rv.radial_velocity
+MODES = [('serial', dict(mc_engine='serial')),
+         ('batch-gauss', dict(peak_mode='gauss')),
+         ('batch-parabola', dict(peak_mode='parabola')),
+         ('batch-centroid', dict(peak_mode='centroid')),
+         ('batch-loggauss', dict(peak_mode='loggauss')),
+         ('batch-fixed-std', dict(peak_mode='loggauss', std_noise=False)),
+         ('adaptive', dict(peak_mode='loggauss', adaptive=True)),
+         ('parallel', dict(peak_mode='loggauss', workers=2)),
+         ('analytic', dict(error_mode='analytic')),
+         ('chi2', dict(error_mode='chi2'))]
+
+
+def synth_spec(wv, centers, depths, rv, snr, rng):
+    '''
+    Returns the flux and flux uncertainty of a spectrum with gaussian absorption lines (width set by RESOLUTION) at
+    rest wavelengths centers, shifted by rv (km/s), with gaussian noise of 1/snr.
+    '''
+    shifted = centers * (1 + rv / spectools.C_KMS)
+    width = shifted / RESOLUTION / 2.355
+    fx = 1 - (depths * numpy.exp(-0.5 * ((wv[:, numpy.newaxis] - shifted) / width) ** 2)).sum(axis=1)
+    sig = numpy.ones(len(wv)) / snr
+    return fx + sig * rng.normal(size=len(wv)), sig
+
+
+def make_sample(trials, seed):
+    '''
+    Returns the wavelength scale, the standard (flux, uncertainty), and a list of targets (injected rv, snr, flux,
+    uncertainty), trials of them per velocity and S/N.
+    '''
+    rng = numpy.random.RandomState(seed)
+    wv = numpy.linspace(WV_MIN, WV_MAX, N_PIX)
+    centers = rng.uniform(WV_MIN + .01, WV_MAX - .01, N_LINES)
+    depths = rng.uniform(.05, .4, N_LINES)
+
+    fx_std, sig_std = synth_spec(wv, centers, depths, 0., STD_SNR, rng)
+    targets = []
+    for rv in VELOCITIES:
+        for snr in SNRS:
+            for trial in range(trials):
+                fx_obj, sig_obj = synth_spec(wv, centers, depths, rv, snr, rng)
+                targets.append((rv, snr, fx_obj, sig_obj))
+
+    return wv, (fx_std, sig_std), targets
+
+
+def _stats(offsets, errs):
+    # Bias and scatter of the measured minus injected velocities, and mean reported uncertainty, over the targets with
+    # a measurement (find_rv returns nan when there is none; n_nan counts those)
+    offsets = numpy.asarray(offsets, dtype=float)
+    errs = numpy.asarray(errs, dtype=float)
+    ok = numpy.isfinite(offsets) & numpy.isfinite(errs)
+    if not ok.any():
+        return dict(n=0, n_nan=len(offsets), bias=float('nan'), scatter=float('nan'), mean_err=float('nan'))
+    return dict(n=int(ok.sum()), n_nan=int((~ok).sum()), bias=float(offsets[ok].mean()), \
+                scatter=float(offsets[ok].std()), mean_err=float(errs[ok].mean()))
+
+
+def _json_safe(value):
+    # Copy of a report with nan and inf replaced by None, which JSON writes as null
+    if isinstance(value, dict):
+        return dict((key, _json_safe(val)) for key, val in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(val) for val in value]
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return None
+    return value
+
+
+def run_mode(name, options, n_iter, trials, seed, queue):
+    '''
+    Measures every synthetic target in one mode and puts its report on queue, or a report holding only the error if
+    the mode fails.  Meant to run in its own process.
+    '''
+    sys.stdout = open(os.devnull, 'w')		#find_rv prints progress for every measurement
+    try:
+        queue.put((name, _run_mode(name, options, n_iter, trials, seed)))
+    except Exception:
+        queue.put((name, dict(options=options, error=traceback.format_exc())))
+
+
+def _run_mode(name, options, n_iter, trials, seed):
+    # Body of run_mode: returns the report of one mode
+    random.seed(seed)		#the serial engine draws its noise from the random module
+
+    wv, std, targets = make_sample(trials, seed)
+    find_rv.clear_standard_cache()
+
+    offsets = {}
+    errs = {}
+    start = time.time()
+    for t_idx, (rv, snr, fx_obj, sig_obj) in enumerate(targets):
+        result = find_rv.radial_velocity(wv, fx_obj, sig_obj, wv, std[0], std[1], 0., 0., name, 'std', \
+                                         n_iter=n_iter, seed=seed + t_idx, plot=False, **options)
+        offsets.setdefault(snr, []).append(result['rv'] - rv)
+        errs.setdefault(snr, []).append(result['rv_err'])
+    wall = time.time() - start
+
+    rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    report = _stats(sum(offsets.values(), []), sum(errs.values(), []))
+    report.update(options=options, wall_time=wall, time_per_rv=wall / len(targets), peak_rss_kb=rss_self, \
+                  peak_rss_children_kb=rss_children)
+    report['by_snr'] = dict(('%g' %(snr), _stats(offsets[snr], errs[snr])) for snr in sorted(offsets))
+    return report
+
+
+def main(modes=None, n_iter=100, trials=5, seed=1):
+    '''
+    Runs the benchmark in the given modes (names from MODES, default all of them) and returns the report as a
+    dictionary.
+    '''
+    if modes is None:
+        modes = [mode[0] for mode in MODES]
+    options = dict(MODES)
+    unknown = [mode for mode in modes if mode not in options]
+    if unknown:
+        raise ValueError('Unknown modes: %s' %(', '.join(unknown)))
+
+    report = dict(created=time.strftime('%Y-%m-%dT%H:%M:%S'), python=sys.version.split()[0], \
+                  numpy=numpy.__version__, cpus=multiprocessing.cpu_count(), \
+                  settings=dict(n_iter=n_iter, trials=trials, seed=seed, n_pix=N_PIX, resolution=RESOLUTION, \
+                                velocities=VELOCITIES, snrs=SNRS, std_snr=STD_SNR), modes={})
+
+    for mode in modes:
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=run_mode, args=(mode, options[mode], n_iter, trials, seed, queue))
+        proc.start()
+
+        # Wait for the report, unless the process dies without sending one (e.g. killed, or out of memory)
+        mode_report = None
+        while mode_report is None:
+            try:
+                name, mode_report = queue.get(timeout=1)
+            except Queue.Empty:
+                if proc.exitcode is not None and queue.empty():
+                    name, mode_report = mode, dict(options=options[mode], \
+                                                   error='process exited with code %d' %(proc.exitcode))
+        proc.join()
+
+        report['modes'][name] = mode_report
+        if 'error' in mode_report:
+            print >> sys.stderr, '%-16s FAILED: %s' %(name, mode_report['error'].strip().splitlines()[-1])
+        else:
+            print >> sys.stderr, '%-16s %8.2f s  bias %7.3f  scatter %7.3f km/s' \
+                %(name, mode_report['wall_time'], mode_report['bias'], mode_report['scatter'])
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark find_rv on synthetic spectra.')
+    parser.add_argument('-o', '--out', help='JSON output file (default: stdout)')
+    parser.add_argument('-m', '--modes', nargs='+', help='modes to run (default: all): ' + \
+                        ', '.join(mode[0] for mode in MODES))
+    parser.add_argument('--n-iter', type=int, default=100, help='Monte Carlo realizations per measurement')
+    parser.add_argument('--trials', type=int, default=5, help='targets per injected velocity and S/N')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    report = _json_safe(main(args.modes, args.n_iter, args.trials, args.seed))
+
+    if args.out is None:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True, allow_nan=False)
+        print
+    else:
+        with open(args.out, 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True, allow_nan=False)
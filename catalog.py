@@ -0,0 +1,273 @@
+'''
+Loader for the tab-delimited object catalogs (e.g. NIR_Spex_Prism_with_optical_12Aug15.txt) used by nir_opt_comp*.py and jk_plot_*.py. The first time a catalog is loaded it is parsed with asciidata, its derived columns are added (see derive_columns: J-K color, numeric spectral type, gravity class), and the whole table is saved as a NumPy structured array (.npy) in a cache folder. Later loads memory-map that file, as long as the catalog has the same path, size and modification time. Each load also indexes the spectral types by prefix (see type_index), so that selecting the objects of a type is a dictionary lookup, and catalogs stay loaded for the rest of the session.
+'''
+
+import hashlib
+import numpy
+import os
+import re
+
+CACHE_DIR = None # Folder for the cached tables (None: a .cache folder next to each catalog)
+
+NULL_CHAR = ''   # Null character
+DELL_CHAR = '\t' # Delimiter character
+COMM_CHAR = '#'  # Comment character
+
+# Positions in the catalog header of the columns used by derive_columns
+COL_DESIG = 1
+COL_J = 2
+COL_K = 4
+COL_TYPE = 6
+COL_YOUNG = 14
+COL_DUSTY = 15
+COL_BLUE = 16
+COL_BINARY = 17 # 'Binary?' or 'Multiple?'
+COL_PEC = 18
+COL_JK = 'J-K'
+COL_SPNUM = 'SpType_num'
+COL_GRAV = 'Grav'
+COL_FLAGS = 'Flags'
+DERIVED = [COL_JK, COL_SPNUM, COL_GRAV, COL_FLAGS]
+TYPE_INDEX = 'SpType_index' # Key of the spectral-type indexes in a loaded catalog (not a column)
+
+# Bits of the COL_FLAGS column
+FLAG_YOUNG = 1
+FLAG_DUSTY = 2
+FLAG_BLUE = 4
+FLAG_BINARY = 8
+FLAG_PEC = 16
+FLAG_GAMMA = 32
+FLAG_BETA = 64
+FLAG_STANDARD = 128 # Not stored in the catalog: set by the caller for the NIR standard of a query
+FLAG_LOWGRAV = FLAG_YOUNG | FLAG_GAMMA | FLAG_BETA
+
+SPTYPE_ZERO = {'M': 0., 'L': 10., 'T': 20., 'Y': 30.} # Numeric type of M0, L0, T0 and Y0
+GAMMA = u'\u03b3' # "\xce\xb3" in utf-8
+BETA  = u'\u03b2' # "\xce\xb2" in utf-8
+CACHE_VERSION = 3 # Changes whenever the cached table changes layout
+
+_SPTYPE_RE = re.compile(r'\s*([MLTY])\s*(\d+(?:\.\d+)?)', re.UNICODE)
+_PREFIX_RE = re.compile(r'[MLTY][\d.]*') # Spectral class and subclass at the start of a type (e.g. L0.5 in L0.5pec)
+
+_LOADED = {} # Catalogs loaded in this session: full path -> (cache file, indexed columns, catalog)
+
+
+def derive_columns(data, header):
+    '''
+    This function adds the derived columns to a catalog stored as a dictionary of column arrays, for all rows at once: it converts into unicode the Spectral Type-Text column, formats the designations (from "XX XX XX.X +XX XX XX.X" to "XXXX+XXXX"), and adds the J-K color (COL_JK), the numeric spectral type (COL_SPNUM, see SPTYPE_ZERO) and the gravity class (COL_GRAV: 'g' for types ending in gamma, 'b' for beta, 'f' otherwise) and the flags of each object packed into one byte (COL_FLAGS: FLAG_YOUNG, FLAG_DUSTY, FLAG_BLUE, FLAG_BINARY and FLAG_PEC from the 'Yes' columns, FLAG_GAMMA and FLAG_BETA from the gravity class).
+
+    *data*
+      Dictionary with the catalog columns, keyed by the names in *header*.
+    *header*
+      Tuple with the column names of the catalog.
+    '''
+
+    colNameDesig = header[COL_DESIG]
+    colNameType = header[COL_TYPE]
+
+    # Convert into unicode the Spectral Type-Text column
+    spType = numpy.char.decode(numpy.asarray(data[colNameType], dtype=str), 'utf-8')
+    data[colNameType] = spType
+
+    # Calculate J-K Color And Add J-K Column
+    data[COL_JK] = data[header[COL_J]] - data[header[COL_K]]
+
+    # Format Designation Number from Designation Column: first four characters, sign, and four characters after it
+    desig = numpy.char.replace(numpy.asarray(data[colNameDesig], dtype=str), ' ', '')
+    plusParts = numpy.char.partition(desig, '+')
+    minusParts = numpy.char.partition(desig, '-')
+    noPlus = plusParts[:,1] == ''
+    sign = numpy.where(noPlus, '-', '+')
+    after = numpy.where(noPlus, minusParts[:,2], plusParts[:,2]).astype('S4')
+    data[colNameDesig] = numpy.char.add(numpy.char.add(desig.astype('S4'), sign), after)
+
+    # Numeric spectral type (e.g. L0.5 is 10.5), nan where the type is not understood
+    matches = [_SPTYPE_RE.match(sType) for sType in spType]
+    data[COL_SPNUM] = numpy.array([SPTYPE_ZERO[m.group(1)] + float(m.group(2)) if m else numpy.nan for m in matches])
+
+    # Gravity class from the greek letter at the end of the spectral type
+    data[COL_GRAV] = numpy.where(numpy.char.endswith(spType, GAMMA), 'g', \
+                                 numpy.where(numpy.char.endswith(spType, BETA), 'b', 'f'))
+
+    # Flags packed into one byte per object
+    flags = numpy.zeros(len(spType), dtype=numpy.uint8)
+    for colIdx, bit in ((COL_YOUNG, FLAG_YOUNG), (COL_DUSTY, FLAG_DUSTY), (COL_BLUE, FLAG_BLUE), \
+                        (COL_BINARY, FLAG_BINARY), (COL_PEC, FLAG_PEC)):
+        isYes = numpy.char.upper(numpy.asarray(data[header[colIdx]], dtype=str)) == 'YES'
+        flags[isYes] |= bit
+    flags[data[COL_GRAV] == 'g'] |= FLAG_GAMMA
+    flags[data[COL_GRAV] == 'b'] |= FLAG_BETA
+    data[COL_FLAGS] = flags
+
+
+def select_targets(flags, rules, exclude=None):
+    '''
+    This function classifies objects by their flags (see COL_FLAGS) with a list of rules, all objects at once. Each rule is a tuple (label, anyOf, noneOf): an object matches it when it has at least one of the bits in anyOf (any object, if anyOf is 0) and none of the bits in noneOf. Objects take the label of the first rule they match, and 'exclude' when they match none. Returns a list with the label of each object.
+
+    *flags*
+      Array with the flags of the objects.
+    *rules*
+      List of rules, e.g. [('young', FLAG_GAMMA, FLAG_BLUE | FLAG_DUSTY)].
+    *exclude*
+      Boolean array, objects to label 'exclude' regardless of the rules.
+    '''
+
+    flags = numpy.asarray(flags, dtype=numpy.uint8)
+    masks = []
+    for label, anyOf, noneOf in rules:
+        mask = (flags & noneOf) == 0
+        if anyOf:
+            mask &= (flags & anyOf) != 0
+        masks.append(mask)
+    if exclude is not None:
+        masks = [mask & ~numpy.asarray(exclude, dtype=bool) for mask in masks]
+
+    if not rules:
+        return ['exclude'] * len(flags)
+    return numpy.select(masks, [rule[0] for rule in rules], 'exclude').tolist()
+
+
+def type_index(spTypes, sortKey=None):
+    '''
+    This function returns an index of spectral types by prefix: a dictionary from every prefix of the spectral class and subclass of the types (e.g. 'L', 'L0', 'L0.' and 'L0.5' for L0.5pec) to the array of rows with types starting with it, sorted by *sortKey* (stable, so rows with the same key keep their order). Prefixes are upper case.
+
+    *spTypes*
+      Array with the spectral types.
+    *sortKey*
+      Array with the value to sort the rows by (e.g. the J-K color); None keeps them in catalog order.
+    '''
+
+    if sortKey is None:
+        order = numpy.arange(len(spTypes))
+    else:
+        order = numpy.argsort(sortKey, kind='mergesort')
+
+    rows = {}
+    for row in order:
+        match = _PREFIX_RE.match(spTypes[row].upper())
+        if match:
+            subType = match.group()
+            for end in range(1, len(subType) + 1):
+                rows.setdefault(subType[:end], []).append(row)
+
+    return dict((prefix, numpy.array(rowList)) for prefix, rowList in rows.items())
+
+
+def select_type(data, colName, spInput):
+    '''
+    This function returns the rows of a catalog whose spectral type starts with *spInput* (case insensitive), sorted like its index (by J-K color in catalogs with derived columns, see load_catalog). Inputs that are a spectral class and subclass (e.g. L0 or L0.5) are looked up in the index; anything else is searched row by row.
+
+    *data*
+      Catalog, as returned by load_catalog.
+    *colName*
+      String with the name of the spectral type column.
+    *spInput*
+      String with the spectral type (e.g. L0).
+    '''
+
+    prefix = spInput.upper()
+    index = data.get(TYPE_INDEX, {}).get(colName)
+    match = _PREFIX_RE.match(prefix)
+    if index is not None and match and match.end() == len(prefix):
+        return index.get(prefix, numpy.array([], dtype=int))
+
+    rows = numpy.array([spIdx for spIdx,spType in enumerate(data[colName]) if spType.upper().startswith(prefix)], dtype=int)
+    if COL_JK in data:
+        rows = rows[numpy.argsort(data[COL_JK][rows], kind='mergesort')]
+    return rows
+
+
+def _cache_names(fileName, header, derive):
+    # Cache file for the current state (path, size, mtime) of a catalog, and the prefix of all its cache files
+    fileName = os.path.abspath(fileName)
+    stat = os.stat(fileName)
+
+    folder = CACHE_DIR
+    if folder is None:
+        folder = os.path.join(os.path.dirname(fileName), '.cache')
+
+    prefix = 'catalog_' + hashlib.sha1(fileName).hexdigest()[:16] + '_'
+    state = repr((stat.st_size, stat.st_mtime, tuple(header), derive, CACHE_VERSION))
+    return os.path.join(folder, prefix + hashlib.sha1(state).hexdigest()[:16] + '.npy'), folder, prefix
+
+
+def _to_table(data, names):
+    # Packs a dictionary of column arrays into a structured array (strings with fixed width, so it can be memory-mapped)
+    columns = []
+    for name in names:
+        col = numpy.asarray(data[name])
+        if col.dtype == object:
+            col = numpy.array([str(val) for val in col])
+        columns.append(col)
+    return numpy.rec.fromarrays(columns, names=list(names)).view(numpy.ndarray)
+
+
+def _read_table(fileName, header, derive, cacheFile, folder, prefix):
+    # Reads a catalog from its cached table, or parses and caches it
+
+    # Load cached table
+    if os.path.exists(cacheFile):
+        table = numpy.load(cacheFile, mmap_mode='r')
+        return dict((name, table[name]) for name in table.dtype.names)
+
+    # Read data from catalog
+    import asciidata
+
+    dataRaw = asciidata.open(fileName, NULL_CHAR, DELL_CHAR, COMM_CHAR)
+    data = {}.fromkeys(header)
+    for colIdx,colData in enumerate(dataRaw):
+        data[header[colIdx]] = colData.tonumpy()
+
+    if derive:
+        derive_columns(data, header)
+
+    # Save table to the cache (then rename, so readers never see partial files), removing older versions
+    names = [name for name in header if data[name] is not None]
+    if derive:
+        names.extend(DERIVED)
+    table = _to_table(data, names)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    for oldFile in os.listdir(folder):
+        if oldFile.startswith(prefix):
+            os.remove(os.path.join(folder, oldFile))
+    tmpFile = cacheFile + '.%d.tmp.npy' % os.getpid()
+    numpy.save(tmpFile, table)
+    os.rename(tmpFile, cacheFile)
+
+    return data
+
+
+def load_catalog(fileName, header, derive=True, typeCols=None):
+    '''
+    This function returns a catalog as a dictionary of column arrays keyed by the names in *header* (like the data dictionaries of nir_opt_comp*.main), plus the derived columns (see derive_columns) if *derive*, and the indexes of its spectral type columns under TYPE_INDEX (see type_index and select_type; sorted by J-K color if *derive*). The table is read from the cache when the catalog has not changed since it was cached; otherwise it is parsed and cached again. Columns read from the cache are read-only memory-mapped arrays. Later calls for an unchanged catalog return the same dictionary, so it must not be modified.
+
+    *fileName*
+      String with the full path of the tab-delimited catalog.
+    *header*
+      Tuple with the column names of the catalog.
+    *derive*
+      Boolean, whether to add the derived columns (the catalog must have the layout of HDR_FILE_IN in nir_opt_comp*.py).
+    *typeCols*
+      List with the names of the spectral type columns to index (default: the Spectral Type-Text column if *derive*, none otherwise).
+    '''
+
+    fileName = os.path.abspath(fileName)
+    cacheFile, folder, prefix = _cache_names(fileName, header, derive)
+    if typeCols is None:
+        typeCols = [header[COL_TYPE]] if derive else []
+
+    # 1. Return catalog if already loaded ---------------------------
+    loaded = _LOADED.get(fileName)
+    if loaded is not None and loaded[:2] == (cacheFile, list(typeCols)):
+        return loaded[2]
+
+    # 2. Read cached table, or parse catalog -----------------------
+    data = _read_table(fileName, header, derive, cacheFile, folder, prefix)
+
+    # 3. Index spectral types ---------------------------------------
+    sortKey = data[COL_JK] if derive else None
+    data[TYPE_INDEX] = dict((colName, type_index(data[colName], sortKey)) for colName in typeCols)
+    _LOADED[fileName] = (cacheFile, list(typeCols), data)
+
+    return data
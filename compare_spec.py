@@ -2,119 +2,6 @@
 This procedure compares two or more individual spectra. It plots their NIR spectra normalized by band (J, H, and K).
 '''
 
-def get_spec(unum, separate=False, bandnames=None, bandlimits=None, bandnorms=None, retCoord=False, retST=False):
-    '''
-    This function finds and pulls spectrum from the BDNYC database. Specifically, it looks for low-res, NIR SpeX Prism spectra. It can split and normalize it by the NIR bands (J, H, and K).
-    
-    *unum*
-      String with the U-number of the target (e.g. U20268).
-    *separate*
-      Boolean, whether to split and normalize the spectrum by NIR bands (J, H, and K)
-    *bandnames*
-      List with strings containing the band names used to separate the spectrum (when separate=True)
-    *bandlimits*
-      Dictionary with keys *bandnames*, each key containing a list with float numbers specifying the bands limits (e.g. {'J': [0.8,1.4], 'H': [1.4,1.9], 'K': [1.9,2.4]}
-    *bandnorms*
-      Same structure as *bandlimits*, this time the float numbers specify the wavelength ranges used to normalize the bands (when separate=True)
-    *retCoord*
-      Boolean, whether to pull from the database the target coordinates
-    *retST*
-      Boolean, whether to pull from the database the target spectral type
-    '''
-    
-    import pickle
-    import BDNYC
-    import astrotools as at
-    
-    # 1. Initialize variables ---------------------------------------
-    FOLDER_DB = '/Users/alejo/Dropbox/Python/Python_Database/'
-    FILE_DB = 'BDNYCData.txt'
-    
-    # 2. Load database ----------------------------------------------
-    f = open(FOLDER_DB + FILE_DB,'rb')
-    bdnyc = pickle.load(f)
-    f.close()
-    
-    # 3. Check data available for target ----------------------------
-    availData = bdnyc.show_data(unum, dump=True)
-    if availData is None:
-        return
-    
-    # 4. Find Spex Prism data ---------------------------------------
-    spexFound = False
-    for row in availData:
-        # Check that row is data row
-        try:
-            row[0] + 1
-        except TypeError:
-            continue
-        # Check that row is nir row
-        try:
-            loc = row.index('nir')
-        except ValueError:
-            continue
-        # Check that row is low res row
-        try:
-            loc = row.index('low')
-        except ValueError:
-            continue
-        # Check that row is Spex Prism row
-        instr = row[3].lower()
-        loc = instr.find('spex')
-        if loc != -1:
-            spexFound = True
-            specIdx = row[0]
-            break
-    if not spexFound:
-        print 'Spectrum for target not found.'
-        return
-    
-    # 5. Fetch target parameters if requested -----------------------
-    params = []
-    if retCoord:
-        ra = availData[4][1][0:5]
-        dec = availData[5][1][0:6]
-        coord = ra + dec
-        coord = coord.replace(' ','')
-        params.append(coord)
-    if retST:
-        st = availData[3][1]
-        params.append(st)
-    
-    # 6. Get spectrum -----------------------------------------------
-    specRaw = bdnyc.get_data(unum, specIdx)
-    
-    # 7. Separate spectrum by bands ---------------------------------
-    if separate:
-        spec = [None] * 3
-        for bIdx, band in enumerate(bandnames):
-            bLim = bandlimits[band][0]
-            bMax = bandlimits[band][1]
-            
-            idx1 = np.where(specRaw[0,:] >= bLim)
-            idx2 = np.where(specRaw[0,:] <= bMax)
-            idx = np.intersect1d(idx1[0], idx2[0])
-            if len(idx) == 0:
-                print 'Error in spectrum range.'
-                return
-            spec[bIdx] = specRaw[:,idx]
-        
-        # 8. Normalize spectrum -------------------------------------
-        specNorm = [None] * 3
-        for bIdx, band in enumerate(bandnames):
-            specNorm[bIdx] = at.norm_spec(spec[bIdx], bandnorms[band])[0]
-        
-        if params != []:
-            return specNorm, params
-        else:
-            return specNorm
-    else:
-        if params != []:
-                return specRaw, params
-        else:
-            return specRaw
-
-
 def plotspec(specData, bandNames, limits, objID, plotInput=None, templ=True):
     
     import numpy
@@ -276,6 +163,7 @@ def plotspec(specData, bandNames, limits, objID, plotInput=None, templ=True):
 # ============================= PROCEDURE =====================================
 
 # 1. LOAD RELEVANT MODULES ----------------------------------------------------
+from bdnyc_db import get_specs
 import astrotools as at
 import numpy as np
 import matplotlib.pyplot as plt
@@ -315,17 +203,17 @@ spectra = {}.fromkeys(BANDS)
 for band in BANDS:
     spectra[band] = []
 
-# Loop through provided U-numbers and consolidate them
-for uIdx, unum in enumerate(UNUMS):
-    specN, parameters = get_spec(unum, separate=True, bandnames=BANDS, \
-                             bandlimits=BAND_LIMS, bandnorms=BAND_NORMS, \
-                             retCoord=True, retST=True)
-    if specN is None:
+# Fetch all provided U-numbers at once and consolidate them
+results = get_specs(UNUMS, separate=True, bandnames=BANDS, \
+                    bandlimits=BAND_LIMS, bandnorms=BAND_NORMS)
+for res in results:
+    if res.status != 'ok':
+        print res.unum + ': spectrum not used (' + res.status + ').'
         continue
     else:
-        all_params.append([unum, parameters[0], parameters[1]])
+        all_params.append([res.unum, res.coord, res.sptype])
         for bdIdx, band in enumerate(BANDS):
-            spectra[band].append(specN[bdIdx])
+            spectra[band].append(res.spec[bdIdx])
     
     # if len(unum) > 3:
     #     specRaw, lblRaw = noc.main(unum, plot=False, lbl=True)
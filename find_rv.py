@@ -6,308 +6,1201 @@ find_rv.py
 Created by Vivienne Baldassare on 2012-03-30.
 Copyright (c) 2012 __MyCompanyName__. All rights reserved.
 
-Description: 
+Description:
 	This code finds the radial velocity of a target when supplied with data for the target and data for a standard object
 	whose radial velocity is known.
 
 Usage:
 	Note: Data used should already be corrected for heliocentric velocity.
-	
+
 	Inputs:
 		wv_obj, fx_obj, and sig_obj are arrays containing data for the the wavelength, flux, and flux uncertainty of the target.
 		wv_std, fx_std, and sig_std are arrays containing data for the the wavelength, flux, and flux uncertainty of the standard.
 		rv_std is the radial velocity of the standard.
 		rv_std_err is the uncertainty in the radial velocity of the standard.
 		obj_name and std_name are strings containing the names of the target and standard.  These are used in the production of plots.
+		mc_engine selects the Monte Carlo engine: 'batch' (default) draws all noise realizations at once and correlates them
+			as a stack; 'serial' is the original one-realization-at-a-time loop.
+		n_iter is the number of noise realizations (default 500).
+		seed seeds the random generator of the 'batch' engine so that results can be reproduced.
+		vel_window is a (min, max) range of velocity, rv_obj - rv_std in km/s, searched for the cross correlation peak by the
+			'batch' engine.  Only the lags inside it are kept, and the FFT length is cut to what those lags need.
+		std_noise, when False, leaves the standard unperturbed in the 'batch' engine so that its transform is computed
+			once and shared by all realizations (use for standards with high S/N).
+		peak_mode selects how the 'batch' engine locates the cross correlation peak of each realization: 'gauss' (default,
+			gaussian fit with analytic Jacobian), 'parabola' or 'centroid' (interpolation around the maximum) or
+			'loggauss' (gaussian fit to the log of the peak, all realizations at once).  compare_peak_modes reports
+			the speed and accuracy of each of them on a stack of cross correlation functions.
+		workers splits the realizations of the 'batch' engine over that many processes.  Each process gets its own seed
+			spawned from seed, so for a given seed and number of workers the result is always the same.
+		plot, when False, skips the figure (see below).
+		adaptive, when True, makes the 'batch' engine draw realizations in blocks of mc_block (default 50) and stop once
+			the mean and standard deviation of the pixel shifts change by less than mc_tol (default .05) times that
+			standard deviation from one block to the next.  n_iter is then the maximum number of realizations; the
+			number actually used is returned as n_iter in the result.
+		error_mode selects how the uncertainty is found: 'mc' (default) from the scatter of the Monte Carlo realizations,
+			or 'analytic' from the curvature and height of a single cross correlation of the unperturbed spectra and
+			the number of pixels (Zucker 2003).  'analytic' is much faster and meant for quick looks at large samples;
+			it returns the same result fields, with one pix_shift value and n_iter = 0.  'chi2' replaces the cross
+			correlation by a chi-square fit: the standard is shifted to every lag (a bank kept with the prepared
+			standard), scaled to the target analytically, and compared with it in one matrix product; the minimum is
+			refined with a parabola and the uncertainty is where chi-square rises by 1.  It is more robust than the
+			gaussian fit to the CCF at low S/N, and returns the same fields as 'analytic' (ccf holds the chi-square).
+		oversample is the number of points per pixel of the standard on the ln wavelength scale both spectra are
+			resampled onto (default 10).  Fluxes and uncertainties are interpolated onto it in one step, with the
+			uncertainties propagated (spectools.log_resample), and the velocity of one pixel follows from the scale.
+			The Monte Carlo noise is drawn on the native pixels and interpolated the same way, so neighbouring points
+			of the scale share it as they share the flux of the pixels they come from.
+		results_db is an SQLite file where results are stored and looked up (see below; default RESULTS_DB).
+
+	radial_velocity returns the dictionary built by rv_compute (rv, rv_err, pix_shift, ccf, ...), and when plot is True
+	also saves the figure rv_<obj_name>.pdf through plot_rv.  rv_compute and plot_rv can be called separately:
+	rv_compute never imports matplotlib, so batch jobs can run headless and render only the results they need.
+		>>> result = find_rv.rv_compute(wv_obj,fx_obj,sig_obj,wv_std,fx_std,sig_std,rv_std,rv_std_err)
+		>>> find_rv.plot_rv(result, obj_name, std_name)
+
+	To measure many targets against several standards at once, use radial_velocity_batch: it prepares each standard
+	only once and returns a table of radial velocities plus a weighted mean per target.
+		>>> table, combined = find_rv.radial_velocity_batch(targets, standards, rv_stds, rv_std_errs)
+
+	To avoid correlating across telluric gaps, rv_windows measures the radial velocity separately in a list of wavelength
+	windows (several at once with workers > 1) and returns their weighted mean, scatter and reduced chi-square.
+		>>> find_rv.rv_windows(wv_obj,fx_obj,sig_obj,wv_std,fx_std,sig_std,rv_std,rv_std_err,[(1.17,1.33),(1.50,1.75)])
+
+	For double-lined binaries (the Binary? or Multiple? flag of the catalog), todcor correlates the target against one
+	standard per component and returns both radial velocities and their flux ratio.
+		>>> find_rv.todcor(wv_obj,fx_obj,sig_obj,[wv_std1,fx_std1,sig_std1],[wv_std2,fx_std2,sig_std2],rv_std1,rv_std2)
+
+	With RESULTS_DB (or results_db) set to an SQLite file, every result of rv_compute is stored there, keyed by a hash of
+	the spectra, the standard's radial velocity and all the settings.  Repeating a measurement then returns the stored
+	result at once, and results_report lists everything measured so far without recomputing it.
+		>>> find_rv.RESULTS_DB = '/path/to/rv_results.sqlite'
+		>>> report = find_rv.results_report()
+
+	Prepared standards (resampled, and with std_noise=False or error_mode='analytic' also transformed) are cached by
+	get_standard, in memory and, if STD_CACHE_DIR is set to a folder, on disk, so reusing a standard costs nothing.
+		>>> find_rv.STD_CACHE_DIR = '/path/to/cache/'
 
 	Example:
 		>>> import find_rv
 		>>> find_rv.radial_velocity(wv_obj,fx_obj,sig_obj,wv_std,fx_std,sig_std,rv_std,rv_std_err,obj_name,std_name)
+		>>> find_rv.radial_velocity(wv_obj,fx_obj,sig_obj,wv_std,fx_std,sig_std,rv_std,rv_std_err,obj_name,std_name,seed=42)
 
 """
 
-from array import array
-import asciitable
+import collections
+import hashlib
 import math
-import matplotlib.pyplot as plt
-import matplotlib.mlab as mlab
 import numpy
-import pyfits
-import pylab
+import os
 import random
 import scipy
 from scipy.stats import norm
-from scipy import constants
-from scipy import interpolate
 import scipy.optimize as op
-import scipy.ndimage
-import sys
-import pdb
-import pyspeckit
-
-def radial_velocity(wv_obj,fx_obj,sig_obj,wv_std,fx_std,sig_std,rv_std,rv_std_err,obj_name,std_name):
-
-# Find where standard and object overlap ---------------
-
-	wv_min = max([min(wv_std),min(wv_obj)])
-	wv_max = min([max(wv_std),max(wv_obj)])
-
-
-# Overlap wv_obj and wv_std arrays.  Where they do not overlap, flux is set to 1 ---------------- 
-	length=len(wv_obj)
-	# For standard
-	a_param = wv_std > wv_min
-	b_param = wv_std < wv_max  
-	i=0
-	j=0
-	while i < length:
-		if a_param[i] == False:
-			fx_std[i]=1
-			i=i+1
-		else:
-			i=i+1
-	while j < length:
-		if b_param[j] == False:
-			fx_std[j]=1
-			j=j+1
-		else:
-			j=j+1	
-	n_pix_std = len(wv_std)
-	# For object
-	a_param = wv_obj > wv_min
-	b_param = wv_obj < wv_max
-	i=0
-	j=0
-	while i < length:
-		if a_param[i] == False:
-			fx_obj[i]=1
-			i=i+1
-		else:
-			i=i+1
-	while j< length: 
-		if b_param[j] == False:
-			fx_obj[j]=1
-			j=j+1
-		else:
-			j=j+1
-	n_pix_obj = len(wv_obj)
-
-
-
-# Creates ln standard wavelength array ---------------------------------
-	min_wv_std = min(wv_std)
-	max_wv_std = max(wv_std)
-	acoef_std = (n_pix_std -1)/(math.log(max_wv_std) - math.log(min_wv_std))
-	bcoef_std = (n_pix_std) - (acoef_std * math.log(max_wv_std))
-
-	arr = numpy.arange(n_pix_std)+1
-	wv_ln_std = numpy.exp((arr - bcoef_std)/acoef_std)
-	
-	
-# Interpolate data onto same ln wavelength scale -------------------------------
-
-	fx_interp_std = numpy.interp(wv_ln_std, wv_std, fx_std) 
-	fx_interp_obj = numpy.interp(wv_ln_std, wv_obj, fx_obj)
-
-
-# Rebin Data ----------------------------
-
-	wv_arr_std=numpy.asarray(wv_ln_std,dtype=float)
-	fx_arr_obj=numpy.asarray(fx_interp_obj,dtype=float)
-	fx_arr_std=numpy.asarray(fx_interp_std,dtype=float)
-	sig_arr_obj=numpy.asarray(sig_obj,dtype=float)
-	sig_arr_std=numpy.asarray(sig_std,dtype=float)
-	
-	wv_ln_rebin_std=scipy.ndimage.interpolation.zoom(wv_arr_std,10)		#data rebinned by factor of 10
-	fx_rebin_obj=scipy.ndimage.interpolation.zoom(fx_arr_obj,10)
-	fx_rebin_std=scipy.ndimage.interpolation.zoom(fx_arr_std,10)
-	sig_rebin_obj=scipy.ndimage.interpolation.zoom(sig_arr_obj,10)
-	sig_rebin_std=scipy.ndimage.interpolation.zoom(sig_arr_std,10)
-
-	
-# Plot object and standard so you can clearly see that shift exists --------------------------------
-	plt.figure(1)
-	plt.plot(wv_ln_rebin_std,fx_rebin_obj,'r')
-	plt.plot(wv_ln_rebin_std,fx_rebin_std,'b')
-	v=[1.545,1.570,0,2]
-	plt.axis(v)	
-	
-
-# Cross correlation loop -------------------------------- 
+import scipy.fftpack
+import spectools
+
+OVERSAMPLE = 10		# points of the ln wavelength scale per pixel of the standard
+
+# Lags of the cross correlation function searched for the peak (at OVERSAMPLE = 10, scaled for other factors).  For
+# 1000-pixel spectra these are the ycorr[9750:10750] slice of the full correlation.
+LAG_MIN = -249
+LAG_MAX = 750
+
+MC_BLOCK = 100		# number of noise realizations correlated per FFT call (bounds memory)
+MC_MIN_INSIDE = .5		# fraction of realizations with their CCF peak inside the lag window needed for a measurement
+MC_NOISE = 1.		# standard deviation of the Monte Carlo noise, in units of the flux uncertainty (the first loop used .34)
+
+PEAK_MODES = ('gauss', 'parabola', 'centroid', 'loggauss')
+
+STD_CACHE_SIZE = 16		# prepared standards kept in memory (see get_standard)
+STD_FT_SIZE = 8		# transforms kept per prepared standard, one per target overlap and FFT length (see _std_transform)
+STD_CACHE_DIR = None		# folder for prepared standards saved as .npz files (None: memory only)
+RESULTS_DB = None		# SQLite file where rv_compute stores its results and looks them up (None: no results store)
+_std_cache = collections.OrderedDict()
+
+
+def _make_rng(seed=None):
+	# Seeded numpy.random.Generator (RandomState on numpy versions without default_rng).  A generator passes through.
+	if hasattr(seed, 'normal'):
+		return seed
+	try:
+		return numpy.random.default_rng(seed)
+	except AttributeError:
+		return numpy.random.RandomState(seed)
+
+
+def _fit_gauss(ycorr1, guess=None):
+	# Fits a gaussian plus constant to a section of the cross correlation function
+	xcorr = numpy.arange(len(ycorr1))	#create x axis values
+
+	def chi2(p):	#define gaussian function for fitting
+		sig2=p[2] ** 2
+		m = (p[0] * numpy.exp(-0.5 * (xcorr - p[1]) ** 2 / sig2)) + p[3]
+		return (ycorr1 - m)
+
+	def jac(p):	#analytic derivatives of chi2 with respect to amp, mean, sig and sky
+		d = xcorr - p[1]
+		e = numpy.exp(-0.5 * d ** 2 / p[2] ** 2)
+		return -numpy.column_stack((e, p[0] * e * d / p[2] ** 2, p[0] * e * d ** 2 / p[2] ** 3, numpy.ones(len(d))))
+
+	if guess is None:
+		guess = [6000, 300, 100, 1000]	# guess some values (amp, mean, sig, sky)
+
+	return op.leastsq(chi2, guess, Dfun=jac)[0]
+
+
+def _gauss_guess(ycorr1, width=None):
+	# Starting values (amp, mean, sig, sky) of the gaussian fit to a CCF: height and position of its maximum over the
+	# median, and the half width of its peak (see _peak_halfwidth), which scales with the oversampling factor
+	if width is None:
+		width = _peak_halfwidth(ycorr1[numpy.newaxis, :])
+	sky = numpy.median(ycorr1)
+	k = ycorr1.argmax()
+	return [ycorr1[k] - sky, k, width, sky]
+
+
+def _mc_serial(fx_rebin_obj, noise_obj, fx_rebin_std, noise_std, n_iter, lags):
+	# Original Monte Carlo loop: one noise realization, correlation and fit at a time.  Noise is drawn on the native
+	# pixels of object and standard and interpolated onto the rebinned scale (see _draw_noise).  The section of the full
+	# correlation searched for the peak holds the requested lags (ycorr[9750:10750] for 10000-point scales and the
+	# default lags); lag 0 is at index len - 1.
 	pix_shift=[]		#initialize array for pixel shift values
-	l = 0
+	sig_obj, idx_obj, frac_obj = noise_obj
+	sig_std, idx_std, frac_std = noise_std
+	start = lags[0] + (len(fx_rebin_obj) - 1)
+	stop = lags[-1] + len(fx_rebin_obj)
+	if start < 0 or stop > 2 * len(fx_rebin_obj) - 1:
+		raise ValueError('Lags %d to %d are beyond the cross correlation of %d-point spectra; use a smaller ' \
+						 'vel_window' %(lags[0], lags[-1], len(fx_rebin_obj)))
+
+	for l in range(0,n_iter):
 
-	for l in range(0,500):
-	
 	# GETTING ARRAYS READY FOR CROSS CORRELATION
-		
+
 		# Randomize noise:
-		# create gaussian distribution of random numbers b/t 1 and -1, multiply err by numbers, add numbers to flux
-		fx_temp_obj=[None]*len(fx_rebin_obj)
-		fx_temp_std=[None]*len(fx_rebin_std)
-		rand_dist=[None]*len(fx_rebin_std)
-		rand_dist2=[None]*len(fx_rebin_std)
-		rand_dist=[random.gauss(0,.34) for i in rand_dist]
-		rand_dist2=[random.gauss(0,.34) for i in rand_dist2]
-		rand_dist=numpy.array(rand_dist)
-		rand_dist2=numpy.array(rand_dist2)
-		fx_temp_obj=numpy.array(fx_temp_obj)
-		fx_temp_std=numpy.array(fx_temp_std)
-		fx_temp_obj = fx_rebin_obj + (sig_rebin_obj * rand_dist)
-		fx_temp_std = fx_rebin_std + (sig_rebin_std * rand_dist2)
-		
-		# Find std dev and mean of flux data
-		mean_obj=fx_temp_obj.mean()
-		mean_std=fx_temp_std.mean()
-		stddev_obj=fx_temp_obj.std()
-		stddev_std=fx_temp_std.std()
-		
+		# create gaussian distribution of random numbers (one per native pixel), multiply err by numbers, and add the
+		# interpolated numbers to the rebinned flux
+		rand_dist=numpy.array([random.gauss(0,MC_NOISE) for i in range(len(sig_obj))])
+		rand_dist2=numpy.array([random.gauss(0,MC_NOISE) for i in range(len(sig_std))])
+		fx_temp_obj = fx_rebin_obj + spectools.interp_stack(sig_obj * rand_dist, idx_obj, frac_obj)
+		fx_temp_std = fx_rebin_std + spectools.interp_stack(sig_std * rand_dist2, idx_std, frac_std)
+
 		# Regularize data (subtract mean, divide by std dev)
-		fx_reg_temp_obj = fx_temp_obj-mean_obj
-		fx_reg_temp_obj = fx_reg_temp_obj/stddev_obj
-		fx_reg_temp_std = fx_temp_std-mean_std
-		fx_reg_temp_std = fx_reg_temp_std/stddev_std
-	
-
-	# CROSS CORRELATION 
-
-		# what you're comparing: obj flux and std flux
-		y1=fx_reg_temp_obj
-		y2=fx_reg_temp_std
-		
-		# compute the cross-correlation between y1 and y2
-		ycorr = scipy.correlate(y1, y2, mode='full')
-		ycorr1=ycorr[9750:10750]	#isolate section of array with gaussian
-
-		length=len(ycorr1)
-		xcorr=range(length)	#create x axis values
-		#print xcorr		
-		
-		def chi2(p):	#define gaussian function for fitting
-			sig2=p[2] ** 2
-			m = (p[0] * numpy.exp(-0.5 * (xcorr - p[1]) ** 2 / sig2)) + p[3]
-			return (ycorr1 - m)	
-		
-		amp = 6000	# guess some values
-		mean = 300
-		sig = 100
-		sky = 1000	
-		
-		amp, mean, sig, sky = op.leastsq(chi2, [amp, mean, sig, sky])[0]
-		
-		
-		#print 'amp=',amp,' mu=',mean, ' sig=',sig, ' sky=',sky
-		
-		print_num=l%50		#prints data every 100 fits
+		fx_reg_temp_obj = (fx_temp_obj - fx_temp_obj.mean()) / fx_temp_obj.std()
+		fx_reg_temp_std = (fx_temp_std - fx_temp_std.mean()) / fx_temp_std.std()
+
+
+	# CROSS CORRELATION
+
+		# compute the cross-correlation between obj flux and std flux
+		ycorr = scipy.correlate(fx_reg_temp_obj, fx_reg_temp_std, mode='full')
+		ycorr1=ycorr[start:stop]	#isolate section of array with gaussian
+
+		amp, mean, sig, sky = _fit_gauss(ycorr1, _gauss_guess(ycorr1))
+
+		print_num=l%50		#prints data every 50 fits
 		if print_num == 0:
 			print 'amp=',amp,' mu=',mean, ' sig=',sig, ' sky=',sky
-		
-		mean1=mean+9750	#add 9750 because I cut array down to just include gaussian
+
+		mean1=mean+start	#add start because I cut array down to just include gaussian
 
 		ycorr_length=len(ycorr)
 		pix_shift_val=(ycorr_length/2) - mean1
+		if ycorr1.argmax() in (0, len(ycorr1) - 1) or not 0 <= mean <= len(ycorr1) - 1:
+			pix_shift_val = numpy.nan	#peak not inside the lag window (see peak_positions)
 
 		pix_shift.append(pix_shift_val)
-		
-		l=l+1	
-
-# End cross correlation loop --------------------------------- 
-	
-
-	#print len(ycorr)	
-	#print pix_shift
-	#pix_shift=numpy.array(pix_shift)	
-	(mu,sigma)=norm.fit(pix_shift)	# get mean and std dev of array of pixel shift values
-	print mu,sigma	
-	
-	my_gauss=[None]*len(xcorr)
-	i=0
-	while i < len(xcorr):	#creating an array based on values determined by gaussian fit
-		sig2=sig ** 2	
-		my_gauss[i] = (amp * (numpy.exp(-0.5 * ((xcorr[i] - mean) ** 2) / sig2))) + sky
-		i=i+1
-	
-# Apply shift to arrays -------------------------------- 
-	
-	fx_rebin_list_obj=fx_rebin_obj.tolist()
-	fx_rebin_list_std=fx_rebin_std.tolist()
-	print 'mu=',mu
+
+	return numpy.array(pix_shift), (amp, mean, sig, sky), ycorr1
+
+
+def _correlate_stack(y1, ft2, nfft, lags):
+	# Cross correlates every row of y1 with ft2, the transform of the standard (one row per realization, or a single
+	# row shared by all of them), and returns only the columns for the requested lags.  Same as
+	# scipy.correlate(y1[i], y2[i], mode='full') at those lags.
+	ft1 = numpy.fft.rfft(y1, nfft, axis=1)
+	ycorr = numpy.fft.irfft(ft1 * ft2.conj(), nfft, axis=1)
+
+	return ycorr[:, lags % nfft]		#negative lags wrap around to the end of the array
+
+
+def _fft_size(n_pix, lags):
+	# Smallest fast FFT length that holds every requested lag without wrap-around
+	return scipy.fftpack.next_fast_len(n_pix + int(numpy.abs(lags).max()))
+
+
+def _lag_window(vel_window=None, kms_pix=None, oversample=OVERSAMPLE):
+	# Lags of the cross correlation function inside a window of velocity (rv_obj - rv_std, in km/s), given the
+	# velocity of one pixel of the ln wavelength scale
+	if vel_window is None:
+		return numpy.arange(LAG_MIN * oversample // 10, LAG_MAX * oversample // 10 + 1)
+	lag_min = int(math.floor(min(vel_window) / kms_pix))
+	lag_max = int(math.ceil(max(vel_window) / kms_pix))
+	return numpy.arange(lag_min, lag_max + 1)
+
+
+def _draw_noise(rng, noise, n_iter):
+	# n_iter noise realizations (one per row) of a rebinned spectrum.  noise is either the uncertainty on the rebinned
+	# scale, drawn independently for every point, or (sig, idx, frac): the uncertainty on the native pixels and the
+	# weights of the interpolation onto the rebinned scale (see spectools.interp_weights).  The latter draws the noise on
+	# the native pixels and interpolates it, so rebinned points that come from the same pixels share it.
+	if isinstance(noise, tuple):
+		sig, idx, frac = noise
+		return spectools.interp_stack(sig * rng.normal(0, MC_NOISE, (n_iter, len(sig))), idx, frac)
+	return noise * rng.normal(0, MC_NOISE, (n_iter, len(noise)))
+
+
+def ccf_stack(fx_rebin_obj, noise_obj, fx_rebin_std, noise_std, n_iter=500, seed=None, lags=None, std_noise=True, \
+              ft_std=None):
+	'''
+	Draws n_iter noise realizations of the rebinned object and standard at once and returns their cross correlation
+	functions as a (n_iter, len(lags)) array, one row per realization, together with the lags of its columns.
+	noise_obj and noise_std are the noise models returned by prep_target (uncertainties on the native pixels plus the
+	weights that put them on the rebinned scale), so the noise is drawn per native pixel.  Plain rebinned uncertainties
+	are also accepted, but their noise is then independent from point to point, which underestimates the scatter of the
+	peak on an oversampled scale.
+	With std_noise=False a precomputed transform of the normalized standard can be passed as ft_std.
+	'''
+	rng = _make_rng(seed)
+	n_pix = len(fx_rebin_obj)
+	if lags is None:
+		lags = _lag_window()
+	nfft = _fft_size(n_pix, lags)
+
+	# Randomize noise for every realization at once (one row per realization)
+	fx_temp_obj = fx_rebin_obj + _draw_noise(rng, noise_obj, n_iter)
+	if std_noise:
+		fx_temp_std = fx_rebin_std + _draw_noise(rng, noise_std, n_iter)
+	else:
+		fx_temp_std = fx_rebin_std[numpy.newaxis, :]
+
+	# Regularize data (subtract mean, divide by std dev) row by row
+	fx_temp_obj -= fx_temp_obj.mean(axis=1)[:, numpy.newaxis]
+	fx_temp_obj /= fx_temp_obj.std(axis=1)[:, numpy.newaxis]
+	fx_temp_std = fx_temp_std - fx_temp_std.mean(axis=1)[:, numpy.newaxis]
+	fx_temp_std /= fx_temp_std.std(axis=1)[:, numpy.newaxis]
+
+	# Without noise on the standard its transform is computed once and shared by all realizations
+	if not std_noise and ft_std is None:
+		ft_std = numpy.fft.rfft(fx_temp_std, nfft, axis=1)
+
+	# Cross correlate the stack, a block of realizations per FFT call
+	ycorr = numpy.empty((n_iter, len(lags)))
+	for i in range(0, n_iter, MC_BLOCK):
+		if std_noise:
+			ft_std = numpy.fft.rfft(fx_temp_std[i:i + MC_BLOCK], nfft, axis=1)
+		ycorr[i:i + MC_BLOCK] = _correlate_stack(fx_temp_obj[i:i + MC_BLOCK], ft_std, nfft, lags)
+
+	return ycorr, lags
+
+
+def _peak_halfwidth(ycorr):
+	# Half width (in lags) of the region used by the centroid and log-gaussian estimators: half the FWHM of the mean CCF
+	mean_ccf = ycorr.mean(axis=0)
+	base = numpy.median(mean_ccf)
+	above = (mean_ccf - base) > 0.5 * (mean_ccf.max() - base)
+	return max(int(above.sum()) // 2, 1)
+
+
+def peak_positions(ycorr, peak_mode='gauss'):
+	'''
+	Sub-pixel position (in units of column index) of the highest peak of every row of a stack of cross correlation
+	functions.  Rows whose maximum is on the first or last column, or whose refined peak falls outside the row, have
+	no peak inside the lag window: their position is nan.
+
+	*peak_mode*
+	  'gauss': gaussian plus constant fit to the whole row (scipy leastsq with analytic Jacobian), one row at a time
+	  'parabola': parabola through the maximum and its two neighbours, all rows at once
+	  'centroid': centroid of the part of the peak above half maximum, all rows at once
+	  'loggauss': weighted least squares parabola to the log of the peak (i.e. a gaussian), all rows at once
+	'''
+	n_row, n_lag = ycorr.shape
+	rows = numpy.arange(n_row)
+	k = ycorr.argmax(axis=1)
+	edge = (k == 0) | (k == n_lag - 1)
+	sky = numpy.median(ycorr, axis=1)
+
+	if peak_mode == 'gauss':
+		pos = numpy.empty(n_row)
+		hw = _peak_halfwidth(ycorr)
+		for l in range(n_row):
+			amp, pos[l], sig, sky_l = _fit_gauss(ycorr[l], _gauss_guess(ycorr[l], hw))
+			if l % 50 == 0:
+				print 'amp=',amp,' mu=',pos[l], ' sig=',sig, ' sky=',sky_l
+
+	elif peak_mode == 'parabola':
+		k = numpy.clip(k, 1, n_lag - 2)
+		y0 = ycorr[rows, k - 1]
+		y1 = ycorr[rows, k]
+		y2 = ycorr[rows, k + 1]
+		curv = y0 - 2 * y1 + y2
+		curv[curv == 0] = -numpy.inf	#flat top: keep the maximum
+		pos = k + 0.5 * (y0 - y2) / curv
+
+	elif peak_mode in ('centroid', 'loggauss'):
+		# Centroid and log-gaussian use a window of +/- one half width around the maximum of each row
+		hw = _peak_halfwidth(ycorr)
+		k = numpy.clip(k, hw, n_lag - hw - 1)
+		offs = numpy.arange(-hw, hw + 1)
+		height = ycorr[rows[:, numpy.newaxis], k[:, numpy.newaxis] + offs] - sky[:, numpy.newaxis]
+
+		if peak_mode == 'centroid':
+			wgt = numpy.clip(height - 0.5 * height.max(axis=1)[:, numpy.newaxis], 0, None)
+			pos = k + (wgt * offs).sum(axis=1) / wgt.sum(axis=1)
+		else:
+			# Normal equations of ln(height) = c0 + c1*x + c2*x**2 weighted by height**2, solved for every row at once
+			height = numpy.clip(height, 1e-10 * height.max(), None)
+			wgt = height ** 2
+			powers = offs[:, numpy.newaxis] ** numpy.arange(5)
+			sums = numpy.dot(wgt, powers)
+			rhs = numpy.dot(wgt * numpy.log(height), powers[:, :3])
+			normal = sums[:, numpy.array([[0, 1, 2], [1, 2, 3], [2, 3, 4]])]
+			coef = numpy.linalg.solve(normal, rhs[:, :, numpy.newaxis])[:, :, 0]
+			pos = k - coef[:, 1] / (2 * coef[:, 2])
+
+	else:
+		raise ValueError('Unknown peak mode: %s' %(peak_mode))
+
+	# No extrapolation: peaks on the edge of the lag window or beyond it are not measured
+	with numpy.errstate(invalid='ignore'):
+		pos[edge | ~((pos >= 0) & (pos <= n_lag - 1))] = numpy.nan
+	return pos
+
+
+def compare_peak_modes(ycorr, modes=PEAK_MODES):
+	'''
+	Runs each peak estimator on the same stack of cross correlation functions (e.g. from ccf_stack) and returns a
+	dictionary with, for every mode, its run time in seconds, the mean and standard deviation of the peak positions,
+	and the mean and rms of their difference from the 'gauss' fit (all in lags).  Rows without a peak inside the lag
+	window (nan positions, see peak_positions) are left out.
+	'''
+	import time
+
+	report = {}
+	ref = None
+	for mode in ['gauss'] + [m for m in modes if m != 'gauss']:
+		t0 = time.time()
+		pos = peak_positions(ycorr, mode)
+		secs = time.time() - t0
+		if ref is None:
+			ref = pos
+		diff = pos - ref
+		report[mode] = dict(time=secs, mean=numpy.nanmean(pos), std=numpy.nanstd(pos), \
+							offset=numpy.nanmean(diff), rms=numpy.sqrt(numpy.nanmean(diff ** 2)))
+
+	return report
+
+
+def _mc_batch(fx_rebin_obj, noise_obj, fx_rebin_std, noise_std, n_iter, seed=None, lags=None, std_noise=True, \
+			  peak_mode='gauss', ft_std=None):
+	# Vectorized Monte Carlo: all noise realizations are drawn at once and correlated as a stack
+	ycorr, lags = ccf_stack(fx_rebin_obj, noise_obj, fx_rebin_std, noise_std, n_iter, seed, lags, std_noise, \
+							ft_std)
+
+	# Find the peak of every correlation function
+	pix_shift = -(lags[0] + peak_positions(ycorr, peak_mode))	#pixel shift is minus the lag of the peak
+
+	# Gaussian fit to the last realization, for plots
+	fit = _fit_gauss(ycorr[-1], _gauss_guess(ycorr[-1]))
+
+	return pix_shift, fit, ycorr[-1]
+
+
+def _mc_adaptive(fx_rebin_obj, noise_obj, fx_rebin_std, noise_std, max_iter, seed=None, lags=None, \
+				 std_noise=True, peak_mode='gauss', tol=.05, block=50, ft_std=None):
+	# Batch engine drawing realizations in blocks.  It stops once the running mean and standard deviation of the pixel
+	# shift both change by less than tol times that standard deviation from one block to the next, or at max_iter.
+	# Returns the pixel shifts, the gaussian fit and CCF of the last realization, and the CCF peak of every realization.
+	rng = _make_rng(seed)
+	shifts = []
+	peaks = []
+	n_done = 0
+	prev = None
+	while n_done < max_iter:
+		n_block = min(block, max_iter - n_done)
+		ycorr, lags = ccf_stack(fx_rebin_obj, noise_obj, fx_rebin_std, noise_std, n_block, rng, lags, \
+								std_noise, ft_std)
+		shifts.append(-(lags[0] + peak_positions(ycorr, peak_mode)))
+		peaks.append(ycorr.max(axis=1))
+		n_done += n_block
+
+		# Check whether mean and std dev of the pixel shift have settled
+		pix_shift = numpy.concatenate(shifts)
+		inside = pix_shift[numpy.isfinite(pix_shift)]		#realizations with their peak inside the lag window
+		stats = (inside.mean(), inside.std()) if len(inside) else (numpy.nan, numpy.nan)
+		if prev is not None and abs(stats[0] - prev[0]) < tol * stats[1] and abs(stats[1] - prev[1]) < tol * stats[1]:
+			break
+		prev = stats
+
+	# Gaussian fit to the last realization, for plots
+	fit = _fit_gauss(ycorr[-1], _gauss_guess(ycorr[-1]))
+
+	return pix_shift, fit, ycorr[-1], numpy.concatenate(peaks)
+
+
+def _analytic_shift(fx_rebin_obj, fx_rebin_std, n_pix, lags, peak_mode='gauss', ft_std=None):
+	# Pixel shift and its uncertainty from a single cross correlation of the unperturbed spectra, following the maximum
+	# likelihood formula of Zucker (2003, MNRAS 342, 1291):
+	#     sigma**2 = -[ N * C''(s)/C(s) * C(s)**2/(1 - C(s)**2) ]**-1
+	# where C is the CCF normalized to a correlation coefficient and N the number of independent (not rebinned) pixels.
+	# Returns the shift (as a one-element array), its uncertainty, the gaussian fit and the normalized CCF.  Shift and
+	# uncertainty are nan when the CCF peak is not inside the lag window.
+	n_rebin = len(fx_rebin_obj)
+	nfft = _fft_size(n_rebin, lags)
+	if ft_std is None:
+		fx_reg_std = (fx_rebin_std - fx_rebin_std.mean()) / fx_rebin_std.std()
+		ft_std = numpy.fft.rfft(fx_reg_std[numpy.newaxis, :], nfft, axis=1)
+	fx_reg_obj = (fx_rebin_obj - fx_rebin_obj.mean()) / fx_rebin_obj.std()
+	ycorr = _correlate_stack(fx_reg_obj[numpy.newaxis, :], ft_std, nfft, lags) / n_rebin
+
+	fit = _fit_gauss(ycorr[0], _gauss_guess(ycorr[0]))
+
+	# Curvature and height of the CCF at its maximum (lags are one rebinned pixel apart).  A maximum on the edge of the
+	# lag window is not a peak (the CCF keeps rising outside the window), and a peak fitted outside the window is an
+	# extrapolation, so in both cases no shift is measured.
+	k = ycorr[0].argmax()
+	curv = 0.
+	if 0 < k < len(lags) - 1:
+		curv = ycorr[0, k - 1] - 2 * ycorr[0, k] + ycorr[0, k + 1]
+		peak = peak_positions(ycorr, peak_mode)[0]
+	if curv >= 0 or not 0 <= peak <= len(lags) - 1:
+		print 'CCF peak is not inside the lag window: no shift measured (the velocity is outside vel_window)'
+		return numpy.array([numpy.nan]), numpy.nan, fit, ycorr[0]
+	height = min(ycorr[0, k], 1 - 1e-12)
+	sigma = math.sqrt(-1. / (n_pix * curv / height * height ** 2 / (1 - height ** 2)))
+
+	return numpy.array([-(lags[0] + peak)]), sigma, fit, ycorr[0]
+
+
+def _template_bank(std, lags):
+	# Standard Doppler-shifted by every lag (one row per lag), computed once per prepared standard and lags.  It is
+	# shared by all targets whatever their overlap with the standard, as _chi2_shift gives no weight to pixels outside it.
+	key = ('bank', lags[0], len(lags))
+	if key not in std['ft']:
+		bank = numpy.empty((len(lags), len(std['fx_rebin'])))
+		for i in range(0, len(lags), MC_BLOCK):		#a block of lags at a time (bounds temporary memory)
+			block = numpy.repeat(std['fx_rebin'][numpy.newaxis, :], len(lags[i:i + MC_BLOCK]), axis=0)
+			bank[i:i + MC_BLOCK] = spectools.shift_spec(block, lags[i:i + MC_BLOCK], method='interp')
+		std['ft'][key] = bank
+	return std['ft'][key]
+
+
+def _chi2_shift(fx_rebin_obj, sig_rebin_obj, bank, lags, overlap, wv_rebin, oversample):
+	# Pixel shift and its uncertainty from the chi-square of the target against every row of a template bank, each
+	# scaled by its analytic best flux factor  a = sum(w*O*T) / sum(w*T**2)  (w = 1/sig**2), which leaves
+	#     chi2 = sum(w*O**2) - sum(w*O*T)**2 / sum(w*T**2)
+	# so the whole bank is evaluated with two matrix products.  The minimum is refined with a parabola through its
+	# neighbours and the uncertainty is where chi2 rises by 1, inflated by the reduced chi-square when above 1.
+	# chi2 is divided by oversample, as the rebinned pixels are not independent.
+	# Returns the shift (as a one-element array), its uncertainty, the fit (scale, index of minimum, 1-sigma half
+	# width in lags, chi2 at minimum) and the chi2 curve.  Shift and uncertainty are nan when the minimum is on the edge
+	# of the lag window, and the uncertainty when the overlap has too few pixels.
+	inside = (wv_rebin > overlap[0]) & (wv_rebin < overlap[1])
+	wgt = numpy.where(inside, 1. / sig_rebin_obj ** 2, 0.)
+	wgt_obj = wgt * fx_rebin_obj
+
+	cross = numpy.dot(bank, wgt_obj)
+	auto = numpy.einsum('ij,ij,j->i', bank, bank, wgt)		#sum(w*T**2) of every row, without squaring the bank
+	chi2 = ((wgt_obj * fx_rebin_obj).sum() - cross ** 2 / auto) / oversample
+
+	# A minimum on the edge of the lag window is not a minimum (chi2 keeps falling outside the window), so no shift is
+	# measured
+	k = chi2.argmin()
+	if not 0 < k < len(lags) - 1 or chi2[k - 1] - 2 * chi2[k] + chi2[k + 1] <= 0:
+		print 'Chi-square minimum is on the edge of the lag window: no shift measured (the velocity is outside vel_window)'
+		return numpy.array([numpy.nan]), numpy.nan, (cross[k] / auto[k], k, numpy.nan, chi2[k]), chi2
+
+	# Parabola through the minimum and its two neighbours
+	y0, y1, y2 = chi2[k - 1], chi2[k], chi2[k + 1]
+	curv = y0 - 2 * y1 + y2
+	mean = k + 0.5 * (y0 - y2) / curv
+	chi2_min = y1 - 0.125 * (y0 - y2) ** 2 / curv
+	half = math.sqrt(2. / curv)		#half width at chi2_min + 1, in lags
+
+	dof = inside.sum() / float(oversample) - 2
+	if dof <= 0:
+		print 'Too few pixels in the overlap for a reduced chi-square: no uncertainty measured'
+		sigma = numpy.nan
+	else:
+		sigma = half * math.sqrt(max(chi2_min / dof, 1.))
+
+	return numpy.array([-(lags[0] + mean)]), sigma, (cross[k] / auto[k], mean, half, chi2_min), chi2
+
+
+def _spawn_seeds(seed, n):
+	# Independent seeds for n workers, spawned from one master seed (drawn from it on numpy without SeedSequence)
+	try:
+		return numpy.random.SeedSequence(seed).spawn(n)
+	except AttributeError:
+		return _make_rng(seed).randint(0, 2 ** 31 - 1, n).tolist()
+
+
+def _mc_worker(args):
+	# Runs one share of the Monte Carlo realizations in a pool process
+	return _mc_batch(*args)
+
+
+def _mc_parallel(fx_rebin_obj, noise_obj, fx_rebin_std, noise_std, n_iter, seed=None, lags=None, \
+				 std_noise=True, peak_mode='gauss', workers=2, ft_std=None):
+	# Splits the realizations of the batch engine over a pool of processes, each with its own spawned seed.
+	# The result only depends on seed and workers, so a run can be repeated exactly.
+	import multiprocessing
+
+	shares = [len(s) for s in numpy.array_split(numpy.arange(n_iter), workers)]
+	seeds = _spawn_seeds(seed, workers)
+	jobs = [(fx_rebin_obj, noise_obj, fx_rebin_std, noise_std, n_share, s, lags, std_noise, peak_mode, ft_std) \
+			for n_share, s in zip(shares, seeds) if n_share > 0]
+
+	pool = multiprocessing.Pool(min(workers, len(jobs)))
+	try:
+		results = pool.map(_mc_worker, jobs)
+	finally:
+		pool.close()
+		pool.join()
+
+	pix_shift = numpy.concatenate([res[0] for res in results])
+	return pix_shift, results[-1][1], results[-1][2]
+
+
+def prep_standard(wv_std, fx_std, sig_std, oversample=OVERSAMPLE):
+	'''
+	Puts a standard on its own ln wavelength scale, oversampled by a factor of oversample (see spectools.log_resample).
+	The returned dictionary can be used with any number of targets (see prep_target), so each standard is only
+	resampled once.
+	'''
+	wv_std = numpy.asarray(wv_std, dtype=float)
+
+	wv_rebin, fx_rebin, sig_rebin = spectools.log_resample(wv_std, fx_std, sig_std, oversample)
+
+	std = {}
+	std['wv'] = wv_std
+	std['n_pix'] = len(wv_std)
+	std['oversample'] = oversample
+	std['wv_rebin'] = wv_rebin
+	std['fx_rebin'] = fx_rebin
+	std['sig_rebin'] = sig_rebin
+	std['sig'] = numpy.asarray(sig_std, dtype=float)
+	std['noise_idx'], std['noise_frac'] = spectools.interp_weights(wv_std, wv_rebin)	#native pixels -> rebinned scale
+	std['kms_pix'] = spectools.kms_per_pixel(wv_rebin)		#velocity of one rebinned pixel
+	std['ft'] = collections.OrderedDict()		#transforms of the normalized standard (by overlap and FFT length) and banks
+
+	return std
+
+
+def _std_key(wv_std, fx_std, sig_std, oversample):
+	# Content hash of a standard and the parameters of its ln wavelength scale
+	digest = hashlib.sha1()
+	for arr in (wv_std, fx_std, sig_std):
+		digest.update(numpy.ascontiguousarray(arr, dtype=float).tobytes())
+	digest.update(('oversample=%d,noise=native' %(oversample)).encode('ascii'))
+	return digest.hexdigest()
+
+
+def get_standard(wv_std, fx_std, sig_std, oversample=OVERSAMPLE, cache_dir=None):
+	'''
+	Same as prep_standard, but prepared standards are kept in memory (the STD_CACHE_SIZE most recently used ones) and,
+	if cache_dir (default STD_CACHE_DIR) is set, saved there as std_<hash>.npz files.  They are keyed by a hash of the
+	contents of wv_std, fx_std and sig_std and of oversample, so a standard is only prepared once however often it is
+	used, and its transforms (kept in the in-memory copy, for its STD_FT_SIZE most recent target overlaps) are only
+	computed once too.
+	'''
+	if cache_dir is None:
+		cache_dir = STD_CACHE_DIR
+	key = _std_key(wv_std, fx_std, sig_std, oversample)
+
+	# In memory: move to the most recently used end
+	if key in _std_cache:
+		std = _std_cache.pop(key)
+		_std_cache[key] = std
+		return std
+
+	# On disk, or prepare it (and save it)
+	std = None
+	if cache_dir is not None:
+		fileNm = os.path.join(cache_dir, 'std_%s.npz' %(key))
+		if os.path.exists(fileNm):
+			data = numpy.load(fileNm)
+			std = dict((name, data[name]) for name in data.files)
+			std['n_pix'] = int(std['n_pix'])
+			std['oversample'] = int(std['oversample'])
+			std['kms_pix'] = float(std['kms_pix'])
+			std['ft'] = collections.OrderedDict()
+	if std is None:
+		std = prep_standard(wv_std, fx_std, sig_std, oversample)
+		if cache_dir is not None:
+			tmpNm = fileNm + '.%d.tmp.npz' %(os.getpid())		#write then rename, so readers never see partial files
+			numpy.savez(tmpNm, **dict((name, std[name]) for name in std if name != 'ft'))
+			os.rename(tmpNm, fileNm)
+
+	_std_cache[key] = std
+	while len(_std_cache) > STD_CACHE_SIZE:
+		_std_cache.popitem(last=False)		#evict the least recently used standard
+
+	return std
+
+
+def clear_standard_cache():
+	'''
+	Empties the in-memory cache of prepared standards (files in the cache directory are left alone).
+	'''
+	_std_cache.clear()
+
+
+def _result_key(wv_obj, fx_obj, sig_obj, wv_std, fx_std, sig_std, rv_std, rv_std_err, settings):
+	# Content hash of a measurement: target, standard, radial velocity of the standard and engine settings
+	digest = hashlib.sha1()
+	for arr in (wv_obj, fx_obj, sig_obj):
+		digest.update(numpy.ascontiguousarray(arr, dtype=float).tobytes())
+	digest.update(_std_key(wv_std, fx_std, sig_std, settings['oversample']).encode('ascii'))
+	digest.update(repr((float(rv_std), float(rv_std_err), sorted(settings.items()))).encode('ascii'))
+	return digest.hexdigest()
+
+
+def _open_results(db):
+	# Connection to a results store, creating its table the first time
+	import sqlite3
+	conn = sqlite3.connect(db)
+	conn.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, target TEXT, standard TEXT, rv REAL, ' \
+				 'rv_err REAL, n_iter INTEGER, error_mode TEXT, created REAL, result BLOB)')
+	return conn
+
+
+def load_result(key, db=None):
+	'''
+	Returns the rv_compute result stored under key in the results store db (default RESULTS_DB), or None.
+	'''
+	import cPickle
+	if db is None:
+		db = RESULTS_DB
+	conn = _open_results(db)
+	try:
+		row = conn.execute('SELECT result FROM results WHERE key = ?', (key,)).fetchone()
+	finally:
+		conn.close()
+	if row is None:
+		return None
+	return cPickle.loads(str(row[0]))
+
+
+def save_result(key, result, db=None, obj_name=None, std_name=None):
+	'''
+	Stores an rv_compute result under key in the results store db (default RESULTS_DB), replacing any older one.
+	'''
+	import cPickle
+	import sqlite3
+	import time
+	if db is None:
+		db = RESULTS_DB
+	conn = _open_results(db)
+	try:
+		with conn:
+			conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', \
+						 (key, obj_name, std_name, float(result['rv']), float(result['rv_err']), \
+						  int(result['n_iter']), result['error_mode'], time.time(), \
+						  sqlite3.Binary(cPickle.dumps(result, 2))))
+	finally:
+		conn.close()
+
+
+def results_report(db=None):
+	'''
+	Table of every measurement in the results store db (default RESULTS_DB), without recomputing any of them.
+	Returns a numpy record array with fields (target, standard, rv, rv_err, n_iter, error_mode, created, key), oldest
+	first; created is a unix time.  Returns None if the store is empty.
+	'''
+	if db is None:
+		db = RESULTS_DB
+	conn = _open_results(db)
+	try:
+		rows = conn.execute('SELECT target, standard, rv, rv_err, n_iter, error_mode, created, key FROM results ' \
+							'ORDER BY created').fetchall()
+	finally:
+		conn.close()
+	if not rows:
+		return None
+	rows = [(str(row[0] or ''), str(row[1] or ''), row[2], row[3], row[4], str(row[5]), row[6], str(row[7])) \
+			for row in rows]
+	return numpy.rec.fromrecords(rows, names='target,standard,rv,rv_err,n_iter,error_mode,created,key')
+
+
+def prep_target(wv_obj, fx_obj, sig_obj, std):
+	'''
+	Puts a target on the oversampled ln wavelength scale of a standard prepared by prep_standard.
+	Where target and standard do not overlap, flux is set to 1 in both.  Returns the rebinned flux and uncertainty of
+	the target and the rebinned flux of the standard, plus the overlap (wv_min, wv_max) and the noise models of target
+	and standard for ccf_stack: (sig, idx, frac), their uncertainty on the native pixels and the weights of the
+	interpolation onto the rebinned scale, as neighbouring rebinned points share the noise of the pixels they come from.
+	'''
+	wv_obj = numpy.asarray(wv_obj, dtype=float)
+
+	# Find where standard and object overlap
+	wv_min = max([min(std['wv']),min(wv_obj)])
+	wv_max = min([max(std['wv']),max(wv_obj)])
+
+	# Where they do not overlap, flux is set to 1
+	fx_obj = numpy.where((wv_obj > wv_min) & (wv_obj < wv_max), fx_obj, 1.)
+	outside = (std['wv_rebin'] <= wv_min) | (std['wv_rebin'] >= wv_max)
+	fx_rebin_std = numpy.where(outside, 1., std['fx_rebin'])
+
+	# Resample onto the standard's ln wavelength scale
+	fx_rebin_obj, sig_rebin_obj = spectools.resample(wv_obj, fx_obj, sig_obj, std['wv_rebin'])
+	idx, frac = spectools.interp_weights(wv_obj, std['wv_rebin'])
+	noise_obj = (numpy.asarray(sig_obj, dtype=float), idx, frac)
+	noise_std = (std['sig'], std['noise_idx'], std['noise_frac'])
+
+	return fx_rebin_obj, sig_rebin_obj, fx_rebin_std, (wv_min, wv_max), noise_obj, noise_std
+
+
+def _std_transform(std, fx_rebin_std, overlap, nfft):
+	# Transform of the normalized standard for one overlap and FFT length, computed once per prepared standard.  Only the
+	# STD_FT_SIZE most recently used ones are kept, as targets with their own wavelength range each need another one.
+	ft = std['ft']
+	key = (overlap, nfft)
+	if key in ft:
+		ft[key] = ft.pop(key)		#move to the most recently used end
+		return ft[key]
+
+	fx_reg_std = (fx_rebin_std - fx_rebin_std.mean()) / fx_rebin_std.std()
+	ft[key] = numpy.fft.rfft(fx_reg_std[numpy.newaxis, :], nfft, axis=1)
+	transforms = [old for old in ft if old[0] != 'bank']		#template banks (see _template_bank) are not evicted
+	for old in transforms[:-STD_FT_SIZE]:
+		del ft[old]
+	return ft[key]
+
+
+def _shift_stats(pix_shift):
+	# Mean and standard deviation of the Monte Carlo pixel shifts with a CCF peak inside the lag window (the others are
+	# nan, see peak_positions); both are nan when fewer than MC_MIN_INSIDE of them have one
+	inside = numpy.isfinite(pix_shift)
+	if inside.sum() < max(MC_MIN_INSIDE * len(pix_shift), 1):
+		print 'CCF peak is not inside the lag window in %d of %d realizations: no shift measured (the velocity is ' \
+			  'outside vel_window)' %(len(pix_shift) - inside.sum(), len(pix_shift))
+		return numpy.nan, numpy.nan
+	return norm.fit(pix_shift[inside])
+
+
+def _rv_from_shift(pix_shift, rv_std, rv_std_err, kms_pix):
+	# Radial velocity of the target and its uncertainty from the Monte Carlo pixel shifts
+	(mu,sigma)=_shift_stats(pix_shift)
+	return rv_std - kms_pix*mu, kms_pix*sigma + rv_std_err
+
+
+def radial_velocity_batch(targets, standards, rv_stds, rv_std_errs, obj_names=None, std_names=None, n_iter=500, \
+						  seed=None, vel_window=None, std_noise=True, peak_mode='gauss', adaptive=False, mc_tol=.05, \
+						  mc_block=50, error_mode='mc', oversample=OVERSAMPLE):
+	'''
+	Measures the radial velocity of every target against every standard, without plots.  Each standard is put on its
+	ln wavelength scale only once (and, with std_noise=False, transformed only once per overlap); see get_standard.
+
+	*targets*, *standards*
+	  Lists of spectra, each one a [wavelength, flux, flux uncertainty] sequence of arrays.
+	*rv_stds*, *rv_std_errs*
+	  Lists with the radial velocity of each standard and its uncertainty.
+	*obj_names*, *std_names*
+	  Lists with the names of targets and standards (their list positions are used if not given).
+	*n_iter*, *seed*, *vel_window*, *std_noise*, *peak_mode*, *adaptive*, *mc_tol*, *mc_block*, *error_mode*, *oversample*
+	  Same as in radial_velocity.  Every (target, standard) pair gets its own seed spawned from *seed*.
+
+	Returns two numpy record arrays: one row per pair with fields (target, standard, rv, rv_err, ccf_peak, n_iter), where
+	ccf_peak is the mean height of the CCF peak per pixel (a correlation coefficient; nan for error_mode='chi2') and n_iter the number of
+	realizations used, and one row per target with
+	fields (target, rv, rv_err, n_std) holding the inverse-variance weighted mean of its radial velocities.  Pairs with
+	no measurement (nan rv, see rv_compute) are left out of that mean, and n_std counts the pairs used.
+	'''
+	if obj_names is None:
+		obj_names = [str(i) for i in range(len(targets))]
+	if std_names is None:
+		std_names = [str(i) for i in range(len(standards))]
+
+	preps = [get_standard(s[0], s[1], s[2], oversample) for s in standards]
+	seeds = _spawn_seeds(seed, len(targets) * len(preps))
+
+	# Measure every pair -------------------------
+	rows = []
+	for t_idx, target in enumerate(targets):
+		for s_idx, std in enumerate(preps):
+			lags = _lag_window(vel_window, std['kms_pix'], oversample)
+			fx_rebin_obj, sig_rebin_obj, fx_rebin_std, overlap, noise_obj, noise_std = prep_target(target[0], target[1], \
+																								   target[2], std)
+			ft_std = None
+			if not std_noise:
+				ft_std = _std_transform(std, fx_rebin_std, overlap, _fft_size(len(fx_rebin_obj), lags))
+
+			if error_mode == 'analytic':
+				if ft_std is None:
+					ft_std = _std_transform(std, fx_rebin_std, overlap, _fft_size(len(fx_rebin_obj), lags))
+				pix_shift, sigma, fit, ycorr1 = _analytic_shift(fx_rebin_obj, fx_rebin_std, std['n_pix'], lags, \
+																peak_mode, ft_std)
+				rv = rv_stds[s_idx] - std['kms_pix']*pix_shift[0]
+				rv_err = std['kms_pix']*sigma + rv_std_errs[s_idx]
+				rows.append((obj_names[t_idx], std_names[s_idx], rv, rv_err, ycorr1.max(), 0))
+				continue
+
+			if error_mode == 'chi2':
+				bank = _template_bank(std, lags)
+				pix_shift, sigma, fit, chi2 = _chi2_shift(fx_rebin_obj, sig_rebin_obj, bank, lags, overlap, \
+														  std['wv_rebin'], oversample)
+				rv = rv_stds[s_idx] - std['kms_pix']*pix_shift[0]
+				rv_err = std['kms_pix']*sigma + rv_std_errs[s_idx]
+				rows.append((obj_names[t_idx], std_names[s_idx], rv, rv_err, numpy.nan, 0))
+				continue
+
+			block = n_iter
+			if adaptive:
+				block = mc_block
+			pix_shift, fit, ycorr1, peaks = _mc_adaptive(fx_rebin_obj, noise_obj, fx_rebin_std, noise_std, \
+														 n_iter, seeds[t_idx * len(preps) + s_idx], lags, std_noise, \
+														 peak_mode, mc_tol, block, ft_std)
+			rv, rv_err = _rv_from_shift(pix_shift, rv_stds[s_idx], rv_std_errs[s_idx], std['kms_pix'])
+			ccf_peak = peaks.mean() / len(fx_rebin_obj)
+
+			rows.append((obj_names[t_idx], std_names[s_idx], rv, rv_err, ccf_peak, len(pix_shift)))
+
+	table = numpy.rec.fromrecords(rows, names='target,standard,rv,rv_err,ccf_peak,n_iter')
+
+	# Combine the standards of each target -------------------------
+	combined = []
+	for t_idx, name in enumerate(obj_names):
+		pairs = table[t_idx * len(preps):(t_idx + 1) * len(preps)]
+		pairs = pairs[numpy.isfinite(pairs.rv) & numpy.isfinite(pairs.rv_err)]		#skip pairs with no measurement
+		if len(pairs) == 0:
+			combined.append((name, numpy.nan, numpy.nan, 0))
+			continue
+		weights = 1. / pairs.rv_err ** 2
+		rv = (weights * pairs.rv).sum() / weights.sum()
+		combined.append((name, rv, 1. / math.sqrt(weights.sum()), len(pairs)))
+
+	combined = numpy.rec.fromrecords(combined, names='target,rv,rv_err,n_std')
+
+	return table, combined
+
+
+def rv_compute(wv_obj,fx_obj,sig_obj,wv_std,fx_std,sig_std,rv_std,rv_std_err,mc_engine='batch',n_iter=500,seed=None,vel_window=None,std_noise=True,peak_mode='gauss',workers=1,adaptive=False,mc_tol=.05,mc_block=50,error_mode='mc',oversample=OVERSAMPLE,results_db=None,obj_name=None,std_name=None):
+	'''
+	Compute core of radial_velocity: measures the radial velocity of the target without making any plot.  Arguments are
+	the same as for radial_velocity.  Returns a dictionary with:
+	  rv, rv_err: radial velocity of the target and its uncertainty (km/s); with error_mode='analytic' or 'chi2', nan
+		when the best match is on the edge of the lag window (the velocity is outside vel_window)
+	  pix_shift: pixel shift of every Monte Carlo realization; mu, sigma: their mean and standard deviation
+		(with error_mode='analytic' or 'chi2': the single measured shift, and its uncertainty)
+	  ccf, lags: cross correlation function of the last realization and its lags; fit: (amp, mean, sig, sky) of the
+		gaussian fit to it, with mean in units of ccf index
+		(with error_mode='chi2': the chi-square at every lag, and (scale, mean, half width, chi2 at minimum) of the
+		parabola fit to it)
+	  wv, fx_obj, fx_std: rebinned ln wavelength scale and fluxes of target and standard (for plots)
+	  kms_pix: velocity (km/s) of one pixel of the ln wavelength scale
+	  rv_std, n_iter: radial velocity of the standard and number of realizations used (0 unless error_mode='mc')
+	  error_mode: 'mc', 'analytic' or 'chi2'
+	If results_db (default RESULTS_DB) is set, results are stored there, under a hash of the spectra, rv_std, rv_std_err
+	and every setting (including seed), and a measurement already stored is returned from it without recomputing.
+	obj_name and std_name are only saved with the result, for results_report.
+	'''
+
+# Look the measurement up in the results store ---------------
+	if results_db is None:
+		results_db = RESULTS_DB
+	if results_db is not None:
+		settings = dict(mc_engine=mc_engine, n_iter=n_iter, seed=seed, vel_window=vel_window, std_noise=std_noise, \
+						peak_mode=peak_mode, workers=workers, adaptive=adaptive, mc_tol=mc_tol, mc_block=mc_block, \
+						error_mode=error_mode, oversample=oversample, mc_noise=MC_NOISE)
+		key = _result_key(wv_obj, fx_obj, sig_obj, wv_std, fx_std, sig_std, rv_std, rv_std_err, settings)
+		result = load_result(key, results_db)
+		if result is not None:
+			return result
+
+# Put standard and object on the same oversampled ln wavelength scale ---------------
+	std = get_standard(wv_std, fx_std, sig_std, oversample)
+	fx_rebin_obj, sig_rebin_obj, fx_rebin_std, overlap, noise_obj, noise_std = prep_target(wv_obj, fx_obj, sig_obj, std)
+
+
+# Cross correlation --------------------------------
+	lags = _lag_window(vel_window, std['kms_pix'], oversample)
+	ft_std = None		#cached transform of the unperturbed standard, when it is used
+	if error_mode == 'analytic' or not std_noise:
+		ft_std = _std_transform(std, fx_rebin_std, overlap, _fft_size(len(fx_rebin_obj), lags))
+
+	if error_mode == 'analytic':
+		pix_shift, sigma, fit, ycorr1 = _analytic_shift(fx_rebin_obj, fx_rebin_std, std['n_pix'], lags, peak_mode, \
+														ft_std)
+	elif error_mode == 'chi2':
+		bank = _template_bank(std, lags)
+		pix_shift, sigma, fit, ycorr1 = _chi2_shift(fx_rebin_obj, sig_rebin_obj, bank, lags, overlap, std['wv_rebin'], \
+													oversample)
+	elif error_mode != 'mc':
+		raise ValueError('Unknown error mode: %s' %(error_mode))
+	elif mc_engine == 'serial':
+		pix_shift, fit, ycorr1 = _mc_serial(fx_rebin_obj, noise_obj, fx_rebin_std, noise_std, n_iter, lags)
+	elif mc_engine == 'batch':
+		if adaptive:
+			pix_shift, fit, ycorr1, peaks = _mc_adaptive(fx_rebin_obj, noise_obj, fx_rebin_std, noise_std, \
+														 n_iter, seed, lags, std_noise, peak_mode, mc_tol, mc_block, \
+														 ft_std)
+		elif workers > 1:
+			pix_shift, fit, ycorr1 = _mc_parallel(fx_rebin_obj, noise_obj, fx_rebin_std, noise_std, n_iter, \
+												  seed, lags, std_noise, peak_mode, workers, ft_std)
+		else:
+			pix_shift, fit, ycorr1 = _mc_batch(fx_rebin_obj, noise_obj, fx_rebin_std, noise_std, n_iter, seed, \
+											   lags, std_noise, peak_mode, ft_std)
+	else:
+		raise ValueError('Unknown Monte Carlo engine: %s' %(mc_engine))
+
+
+# Transform pixel shift to shift in radial velocity --------------------------------
+	if error_mode in ('analytic', 'chi2'):
+		mu = pix_shift[0]
+		n_done = 0
+	else:
+		(mu,sigma)=_shift_stats(pix_shift)	# get mean and std dev of array of pixel shift values
+		n_done = len(pix_shift)
+	rv_obj = rv_std - std['kms_pix']*mu
+	rv_err = std['kms_pix']*sigma + rv_std_err
+
+	result = dict(rv=rv_obj, rv_err=rv_err, pix_shift=pix_shift, mu=mu, sigma=sigma, ccf=ycorr1, lags=lags, \
+				  fit=tuple(fit), wv=std['wv_rebin'], fx_obj=fx_rebin_obj, fx_std=fx_rebin_std, rv_std=rv_std, \
+				  n_iter=n_done, error_mode=error_mode, kms_pix=std['kms_pix'])
+
+	if results_db is not None:
+		save_result(key, result, results_db, obj_name, std_name)
+
+	return result
+
+
+def _window_worker(args):
+	# Measures the radial velocity in one wavelength window, in a pool process
+	spectra, options = args
+	return rv_compute(*spectra, **options)
+
+
+def rv_windows(wv_obj,fx_obj,sig_obj,wv_std,fx_std,sig_std,rv_std,rv_std_err,windows,workers=1,seed=None,**options):
+	'''
+	Measures the radial velocity independently in each of a list of wavelength windows and combines them.
+
+	*windows*
+	  List of (min, max) wavelength ranges, e.g. J/H/K segments clear of telluric gaps, or line-rich regions like the
+	  band ranges in the addannot tables of nir_opt_comp.py.
+	*workers*
+	  Number of processes measuring windows at the same time.
+	*seed*
+	  Master seed; each window gets its own seed spawned from it.
+	*options*
+	  Any other keyword of rv_compute (n_iter, peak_mode, error_mode, vel_window, ...), except mc_engine='serial'.
+
+	Returns a dictionary with:
+	  rv, rv_err: inverse-variance weighted radial velocity of the windows and its uncertainty (km/s).  Windows are
+		weighted by their measurement errors; rv_std_err is added once to the combined error.
+	  scatter: weighted standard deviation of the window radial velocities (km/s)
+	  chi2: reduced chi-square of the window radial velocities about rv (near 1 when they agree within errors)
+	  windows, results: the windows and the rv_compute result of each (None for windows with too few pixels)
+	rv, rv_err, scatter and chi2 are nan when no window has a measurement.
+	'''
+	if options.get('mc_engine', 'batch') == 'serial':
+		raise ValueError("rv_windows does not support mc_engine='serial'; use the batch engine")
+	wv_obj = numpy.asarray(wv_obj, dtype=float)
+	wv_std = numpy.asarray(wv_std, dtype=float)
+
+	# Cut both spectra to every window -------------------------
+	seeds = _spawn_seeds(seed, len(windows))
+	jobs = []
+	for w_idx, window in enumerate(windows):
+		sel_obj = (wv_obj >= min(window)) & (wv_obj <= max(window))
+		sel_std = (wv_std >= min(window)) & (wv_std <= max(window))
+		if sel_obj.sum() < 10 or sel_std.sum() < 10:
+			print 'Window %s has too few pixels; skipped.' %(str(window))
+			jobs.append(None)
+			continue
+		spectra = (wv_obj[sel_obj], numpy.asarray(fx_obj)[sel_obj], numpy.asarray(sig_obj)[sel_obj], \
+				   wv_std[sel_std], numpy.asarray(fx_std)[sel_std], numpy.asarray(sig_std)[sel_std], rv_std, 0.)
+		win_options = dict(options)
+		win_options['seed'] = seeds[w_idx]
+		jobs.append((spectra, win_options))
+
+	# Measure the windows, several at a time if requested -------------------------
+	todo = [job for job in jobs if job is not None]
+	if workers > 1 and len(todo) > 1:
+		import multiprocessing
+		pool = multiprocessing.Pool(min(workers, len(todo)))
+		try:
+			done = pool.map(_window_worker, todo)
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		done = [_window_worker(job) for job in todo]
+	done.reverse()
+	results = [None if job is None else done.pop() for job in jobs]
+
+	# Combine the windows with a measurement -------------------------
+	usable = [res for res in results if res is not None and numpy.isfinite(res['rv']) and numpy.isfinite(res['rv_err'])]
+	if not usable:
+		print 'No window has a radial velocity measurement.'
+		return dict(rv=numpy.nan, rv_err=numpy.nan, scatter=numpy.nan, chi2=numpy.nan, windows=list(windows), \
+					results=results)
+	rvs = numpy.array([res['rv'] for res in usable])
+	errs = numpy.array([res['rv_err'] for res in usable])
+	weights = 1. / errs ** 2
+	rv = (weights * rvs).sum() / weights.sum()
+	rv_err = 1. / math.sqrt(weights.sum()) + rv_std_err
+	scatter = math.sqrt((weights * (rvs - rv) ** 2).sum() / weights.sum())
+	chi2 = numpy.nan
+	if len(rvs) > 1:
+		chi2 = (weights * (rvs - rv) ** 2).sum() / (len(rvs) - 1)
+
+	return dict(rv=rv, rv_err=rv_err, scatter=scatter, chi2=chi2, windows=list(windows), results=results)
+
+
+def todcor(wv_obj,fx_obj,sig_obj,std1,std2,rv_std1,rv_std2,vel_window=None,oversample=OVERSAMPLE):
+	'''
+	Two-dimensional cross correlation (TODCOR, Zucker & Mazeh 1994, ApJ 420, 806) of a double-lined target against
+	two standards, one for each component.
+
+	*std1*, *std2*
+	  The standards, each one a [wavelength, flux, flux uncertainty] sequence of arrays (std1 for the primary).
+	*rv_std1*, *rv_std2*
+	  Float numbers with the radial velocities of the standards.
+	*vel_window*, *oversample*
+	  Same as in radial_velocity; vel_window applies to both components.
+
+	The target, the standards and the two standards against each other are cross correlated once each (FFT, see
+	ccf_stack).  For every pair of lags (s1, s2) the correlation of the target with the combination
+	t1(s1) + alpha * t2(s2), at the alpha that maximizes it, is then
+		R**2 = (C1(s1)**2 - 2*C1(s1)*C2(s2)*C12(s1-s2) + C2(s2)**2) / (1 - C12(s1-s2)**2)
+	which is evaluated for the whole grid of lags at once.
+
+	Returns a dictionary with:
+	  rv1, rv2: radial velocities of the two components (km/s)
+	  flux_ratio: flux (line strength) ratio of the secondary to the primary, alpha scaled by the flux scatter of the
+		standards; alpha: the best weight of the normalized second standard
+	  peak: maximum of R; surface: R for every pair of lags (rows: s1, columns: s2); lags, kms_pix: as in rv_compute
+	'''
+	std = get_standard(std1[0], std1[1], std1[2], oversample)
+	wv_rebin = std['wv_rebin']
+
+	# Put target and second standard on the scale of the first standard; 1 where the three do not overlap
+	wv_min = max(min(std['wv']), min(wv_obj), min(std2[0]))
+	wv_max = min(max(std['wv']), max(wv_obj), max(std2[0]))
+	outside = (wv_rebin <= wv_min) | (wv_rebin >= wv_max)
+	fx_rebin_obj = numpy.where(outside, 1., spectools.resample(wv_obj, fx_obj, sig_obj, wv_rebin)[0])
+	fx_rebin_1 = numpy.where(outside, 1., std['fx_rebin'])
+	fx_rebin_2 = numpy.where(outside, 1., spectools.resample(std2[0], std2[1], std2[2], wv_rebin)[0])
+
+	# The three cross correlations, normalized to correlation coefficients
+	n_rebin = len(wv_rebin)
+	lags = _lag_window(vel_window, std['kms_pix'], oversample)
+	diffs = numpy.arange(lags[0] - lags[-1], lags[-1] - lags[0] + 1)		#every s1 - s2
+	nfft = _fft_size(n_rebin, diffs)
+	regs = [(fx - fx.mean()) / fx.std() for fx in (fx_rebin_obj, fx_rebin_1, fx_rebin_2)]
+	ft_1 = numpy.fft.rfft(regs[1][numpy.newaxis, :], nfft, axis=1)
+	ft_2 = numpy.fft.rfft(regs[2][numpy.newaxis, :], nfft, axis=1)
+	ccf_1, ccf_2 = _correlate_stack(regs[0][numpy.newaxis, :].repeat(2, axis=0), numpy.vstack([ft_1, ft_2]), nfft, \
+									lags) / n_rebin
+	ccf_12 = _correlate_stack(regs[2][numpy.newaxis, :], ft_1, nfft, diffs)[0] / n_rebin
+
+	# Correlation surface over every pair of lags
+	c1 = ccf_1[:, numpy.newaxis]
+	c2 = ccf_2[numpy.newaxis, :]
+	c12 = ccf_12[numpy.subtract.outer(lags, lags) - diffs[0]]
+	c12 = numpy.clip(c12, -1 + 1e-12, 1 - 1e-12)
+	surface = numpy.sqrt(numpy.clip((c1 ** 2 - 2 * c1 * c2 * c12 + c2 ** 2) / (1 - c12 ** 2), 0, None))
+
+	# Peak, refined with a parabola along each axis
+	k1, k2 = numpy.unravel_index(surface.argmax(), surface.shape)
+	k1 = min(max(k1, 1), len(lags) - 2)
+	k2 = min(max(k2, 1), len(lags) - 2)
+	s1 = k1 + peak_positions(surface[k1 - 1:k1 + 2, k2][numpy.newaxis, :], 'parabola')[0] - 1
+	s2 = k2 + peak_positions(surface[k1, k2 - 1:k2 + 2][numpy.newaxis, :], 'parabola')[0] - 1
+
+	alpha = (c1[k1, 0] * c12[k1, k2] - c2[0, k2]) / (c2[0, k2] * c12[k1, k2] - c1[k1, 0])
+	flux_ratio = alpha * fx_rebin_1.std() / fx_rebin_2.std()
+
+	return dict(rv1=rv_std1 + std['kms_pix'] * (lags[0] + s1), rv2=rv_std2 + std['kms_pix'] * (lags[0] + s2), \
+				flux_ratio=flux_ratio, alpha=alpha, peak=surface[k1, k2], surface=surface, lags=lags, \
+				kms_pix=std['kms_pix'])
+
+
+def plot_rv(result, obj_name, std_name, figname=None):
+	'''
+	Plots a result of rv_compute: target and standard with the shift applied, the gaussian fit to the cross correlation
+	function, and the histogram of Monte Carlo radial velocities.  Saves the figure to figname (rv_<obj_name>.pdf by
+	default) and closes it.
+	'''
+	import matplotlib.pyplot as plt
+
+	wv_ln_rebin_std = result['wv']
+	mu = result['mu']
+	amp, mean, sig, sky = result['fit']
+	ycorr1 = result['ccf']
+	xcorr = numpy.arange(len(ycorr1))
+	if result['error_mode'] == 'chi2':
+		my_gauss = sky + ((xcorr - mean) / sig) ** 2		#parabola determined by fit to chi-square
+	else:
+		my_gauss = (amp * (numpy.exp(-0.5 * ((xcorr - mean) ** 2) / sig ** 2))) + sky	#gaussian determined by fit
+
+# Apply shift to arrays (fractional pixels, see spectools.shift_spec) --------------------------------
+	fx_shift_obj=result['fx_obj']
+	fx_shift_std=result['fx_std']
 	if mu < 0:
-		val= abs(mu)	# so we can shift properly	
-		i=0
-		while i < val:
-			del fx_rebin_list_obj[0]
-			fx_rebin_list_obj.append(1)
-			i=i+1
-		print 'mu is negative'		
-	elif mu >= 0:
-		val=mu
-		i=0
-		while i < val:
-			del fx_rebin_list_std[0]	
-			fx_rebin_list_std.append(1)
-			i=i+1
-	print 'mu=',mu		
-
-# Create plots --------------------------------- 
-	
-	fig=plt.figure(l+1, figsize=(10,10))
-	plt.plot([1,2,3])
-	
+		fx_shift_obj = spectools.shift_spec(fx_shift_obj, mu)
+	else:
+		fx_shift_std = spectools.shift_spec(fx_shift_std, -mu)
+
+# Create plots ---------------------------------
+
+	fig=plt.figure(figsize=(10,10))
+
 	#Plots target and standard with shift applied
 	plt.subplot(311)
-	plt.plot(wv_ln_rebin_std, fx_rebin_list_obj, 'red')
-	plt.plot(wv_ln_rebin_std, fx_rebin_list_std, 'blue')
+	plt.plot(wv_ln_rebin_std, fx_shift_obj, 'red')
+	plt.plot(wv_ln_rebin_std, fx_shift_std, 'blue')
 	plt.xlabel('wavelength (microns)')
 	plt.ylabel('normalized flux')
 	target = 'Target: %s' %(obj_name)
 	standard = 'Standard: %s' %(std_name)
-	plt.annotate(target,xy=(.6,.9),xycoords='axes fraction',xytext=(.6,.9),textcoords='axes fraction',color='red') 
-	plt.annotate(standard,xy=(.6,.8),xycoords='axes fraction',xytext=(.6,.8),textcoords='axes fraction',color='blue') 
-	#plt.subplots_adjust(hspace=.5)
-	
+	plt.annotate(target,xy=(.6,.9),xycoords='axes fraction',xytext=(.6,.9),textcoords='axes fraction',color='red')
+	plt.annotate(standard,xy=(.6,.8),xycoords='axes fraction',xytext=(.6,.8),textcoords='axes fraction',color='blue')
+
 	#Plots example of gaussian fit to cross correlation function
 	plt.subplot(312)
 	plt.plot(xcorr, ycorr1, 'k.')
 	plt.plot(xcorr, my_gauss, 'r--', linewidth=2)
 	plt.xlabel('example of fit to cross correlation function')
-	
-	#print pix_shift
-
-# Transform pixel shift to shift in radial velocity -------------------------------- 
-	
-	vshift=.426*mu
-	err=.426*sigma
-	print "vshift=",vshift
-	
-	rv_obj=rv_std-vshift
-	
-	rv_err=err+rv_std_err
-	print "rv_obj=",rv_obj, "+/-", rv_err, ' km/s'
-	
-	rv_obj_round=round(rv_obj,4)
-	err_round=round(rv_err,4)
-	
-	pix_shift_conv1=[.426*i for i in pix_shift]
-	rv_arr=[(rv_std-i) for i in pix_shift_conv1]
-	
-	
-# Plot histogram of pixel shift values -------------------------------- 
+
+# Plot histogram of pixel shift values --------------------------------
+	rv_obj = result['rv']
+	err = result['kms_pix'] * result['sigma']
+	rv_arr = result['rv_std'] - result['kms_pix'] * result['pix_shift']
+	rv_arr = rv_arr[numpy.isfinite(rv_arr)]		#realizations without a peak inside the lag window
+
 	plt.subplot(313)
-	n, bins, patches=plt.hist(rv_arr,normed=1.0,facecolor='green',align='mid') 
+	n, bins, patches=plt.hist(rv_arr,density=True,facecolor='green',align='mid')
 	#Plot best fit gaussian over histogram
-	y=mlab.normpdf(bins,rv_obj,err)
+	y=norm.pdf(bins,rv_obj,err)
 	plt.plot(bins,y,'r--',linewidth=2)
 	plt.xlabel('radial velocity of target')
 	plt.ylabel('frequency (normalized)')
-	rad='RV = %s +/- %s' %(rv_obj_round,err_round)
+	rad='RV = %s +/- %s' %(round(rv_obj,4),round(result['rv_err'],4))
 	plt.annotate(rad,xy=(.6,.9),xycoords='axes fraction',xytext=(.65,.9),textcoords='axes fraction',color='black')
 	plt.subplots_adjust(hspace=.4)
 
-	figname='rv_%s.pdf' %(obj_name)
-	plt.savefig(figname)
-	
-	#plt.figure(l+1)
-	#plt.hist(pix_shift)
-	
+	if figname is None:
+		figname='rv_%s.pdf' %(obj_name)
+	fig.savefig(figname)
+	plt.close(fig)
+
+
+def radial_velocity(wv_obj,fx_obj,sig_obj,wv_std,fx_std,sig_std,rv_std,rv_std_err,obj_name,std_name,mc_engine='batch',n_iter=500,seed=None,vel_window=None,std_noise=True,peak_mode='gauss',workers=1,plot=True,adaptive=False,mc_tol=.05,mc_block=50,error_mode='mc',oversample=OVERSAMPLE,results_db=None):
+
+	result = rv_compute(wv_obj,fx_obj,sig_obj,wv_std,fx_std,sig_std,rv_std,rv_std_err,mc_engine,n_iter,seed, \
+						vel_window,std_noise,peak_mode,workers,adaptive,mc_tol,mc_block,error_mode,oversample,results_db, \
+						obj_name,std_name)
+
+	print result['mu'],result['sigma']
+	print "vshift=",result['kms_pix']*result['mu']
+	print "rv_obj=",result['rv'], "+/-", result['rv_err'], ' km/s'
+
+	if plot and numpy.isfinite(result['rv']):
+		plot_rv(result, obj_name, std_name)
+
+	return result
+
 #END RADIAL VELOCITY FUNCTION -----------------------------------
@@ -152,6 +152,7 @@ def makeplot(dataEB1, dataEB2):
 # 1. LOAD RELEVANT MODULES ---------------------------------------------------------
 import asciidata
 import astrotools as at
+import catalog
 import matplotlib.pyplot as plt
 import numpy as np
 import sys
@@ -193,25 +194,14 @@ NULL_CHAR = ''   # Null character
 DELL_CHAR = '\t' # Delimiter character
 COMM_CHAR = '#'  # Comment character
 
-# File with objects (query in Access)
-dataRaw = asciidata.open(FOLDER_ROOT + FILE_IN, NULL_CHAR, DELL_CHAR, COMM_CHAR)
-
-# Store data in a dictionary-type object
-dataDict = {}.fromkeys(HDR_FILE_IN)
-for colIdx,colData in enumerate(dataRaw):
-    dataDict[HDR_FILE_IN[colIdx]] = colData.tonumpy()
+# File with objects (query in Access), with the formatted columns (unicode
+# Spectral Type-Text, J-K color; see catalog.py)
+dataDict = catalog.load_catalog(FOLDER_ROOT + FILE_IN, HDR_FILE_IN)
 
 numRows = len(dataDict[colRef])
 
 # 4. FORMAT SOME ASCII COLUMNS -----------------------------------------------------
-# Convert into unicode the Spectral Type-Text column
-uniSpType = [None] * numRows
-for sIdx,sType in enumerate(dataDict[colType]):
-    uniSpType[sIdx] = sType.decode('utf-8')
-dataDict[colType] = np.array(uniSpType)
-
-# Calculate J-K Color And Add J-K Column
-dataDict[colJK] = dataDict[colJ] - dataDict[colK]
+# (Done by catalog.derive_columns when the catalog is parsed, and cached with it)
 
 # 5. CREATE PYTHON LIST WITH RELEVANT INFO ON OBJECTS ------------------------------
 dataLs = [dataDict[colRef], dataDict[colJK], dataDict[colType], \
@@ -219,19 +209,8 @@ dataLs = [dataDict[colRef], dataDict[colJK], dataDict[colType], \
           dataDict[colBin], dataDict[colPec]]
 
 # 6. SELECT TARGETS BASED ON GRAVITY PARAMETER -------------------------------------
-# Determine which targets are young
-gravObjs = ['f'] * numRows
-for objIdx, obj in enumerate(dataLs[2]):
-    tmpType = dataLs[2][objIdx].encode('utf-8')
-    tmpLen  = len(tmpType)
-    utcA = tmpType[tmpLen - 2]
-    utcB = tmpType[tmpLen - 1]
-    # GAMMA in utf-8 code is "\xce\xb3"
-    if utcA == '\xce' and utcB == '\xb3':
-        gravObjs[objIdx] = 'g'
-    # BETA in utf-8 code is "\xce\xb2"
-    elif utcA == '\xce' and utcB == '\xb2':
-        gravObjs[objIdx] = 'b'
+# Gravity class of every target: 'g' (gamma), 'b' (beta) or 'f' (see catalog.derive_columns)
+gravObjs = dataDict[catalog.COL_GRAV]
 
 # Determine which targets to include in Kelle's data set
 inclEB1 = np.array([False] * numRows)
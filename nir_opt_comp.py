@@ -635,6 +635,8 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
     # 1. LOAD RELEVANT MODULES ---------------------------------------------------------
     import asciidata
     import astrotools as at
+    import catalog
+    import spectools
     import pyfits
     import numpy
     import sys
@@ -648,7 +650,6 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
     OPTNIR_KEYS = ['OPT','NIR']
     BANDS_NAMES = ['K','H','J','OPT']
     data       = ''
-    dataRaw    = ''
     specFiles  = ''
     spectraRaw = ''
     spectra    = ''
@@ -661,15 +662,8 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
     
     colNameRef   = HDR_FILE_IN[0]
     colNameDesig = HDR_FILE_IN[1]
-    colNameJ     = HDR_FILE_IN[2]
-    colNameK     = HDR_FILE_IN[4]
     colNameJK    = 'J-K'
     colNameType  = HDR_FILE_IN[6]
-    colNameYng   = HDR_FILE_IN[14]
-    colNameDust  = HDR_FILE_IN[15]
-    colNameBlue  = HDR_FILE_IN[16]
-    colNameBin   = HDR_FILE_IN[17]
-    colNamePec   = HDR_FILE_IN[18]
     
     # For TXT standards file
     FILE_IN_STD = 'NIR_Standards.txt'   # ASCII file w/ standards
@@ -680,71 +674,47 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
     # For TXT exclude-objects file
     EXCL_FILE = 'Exclude_Objs.txt'   # ASCII file w/ unums of objects to exclude
     
+    # Targets to plot for each gravity request (see catalog.select_targets): label, flags of which
+    # the target needs at least one (0: any target), flags it must not have
+    NOT_PLOTTED = catalog.FLAG_BLUE | catalog.FLAG_DUSTY | catalog.FLAG_PEC | catalog.FLAG_BINARY
+    GRAV_RULES  = {'Y': [('young', catalog.FLAG_LOWGRAV, NOT_PLOTTED)],  # gamma, beta & young targets
+                   'G': [('young', catalog.FLAG_GAMMA, NOT_PLOTTED)],    # only gamma targets
+                   'B': [('young', catalog.FLAG_BETA, NOT_PLOTTED)],     # only beta targets
+                   'F': [('standard', catalog.FLAG_STANDARD, catalog.FLAG_LOWGRAV | NOT_PLOTTED), # Field & Standard targets
+                         ('field', 0, catalog.FLAG_LOWGRAV | NOT_PLOTTED)],
+                   '':  [('young', catalog.FLAG_YOUNG, NOT_PLOTTED),     # Field, young & Standard targets
+                         ('standard', catalog.FLAG_STANDARD, NOT_PLOTTED),
+                         ('field', 0, NOT_PLOTTED)]}
+    
     
     # 3. READ DATA FROM INPUT FILES-----------------------------------------------------
     NULL_CHAR = ''   # Null character
     DELL_CHAR = '\t' # Delimiter character
     COMM_CHAR = '#'  # Comment character
     
-    # File with objects (query in Access)
-    dataRaw = asciidata.open(FOLDER_ROOT + FILE_IN, NULL_CHAR, DELL_CHAR, COMM_CHAR)
-    
-    # Store data in a dictionary-type object
-    data = {}.fromkeys(HDR_FILE_IN)
-    for colIdx,colData in enumerate(dataRaw):
-        data[HDR_FILE_IN[colIdx]] = colData.tonumpy()
+    # File with objects (query in Access), with the formatted columns (unicode
+    # Spectral Type-Text, J-K color, "XXXX+XXXX" designations; see catalog.py)
+    data = catalog.load_catalog(FOLDER_ROOT + FILE_IN, HDR_FILE_IN)
     
     # File with standards
-    dataRawS = asciidata.open(FOLDER_ROOT + FILE_IN_STD, NULL_CHAR, DELL_CHAR, COMM_CHAR)
-    
-    # Store standard data in a dictionary-type object
-    dataS = {}.fromkeys(HDR_FILE_IN_STD)
-    for colIdx,colData in enumerate(dataRawS):
-        dataS[HDR_FILE_IN_STD[colIdx]] = colData.tonumpy()
+    dataS = catalog.load_catalog(FOLDER_ROOT + FILE_IN_STD, HDR_FILE_IN_STD, derive=False, \
+                                 typeCols=[colNameNIRS])
     
-    # 4. FORMAT SOME ASCII COLUMNS -----------------------------------------------------
-    # 4.1 Convert into unicode the Spectral Type-Text column
-    uniSpType = [None] * len(data[colNameType])
-    for sIdx,sType in enumerate(data[colNameType]):
-        uniSpType[sIdx] = sType.decode('utf-8')
     
-    data[colNameType] = numpy.array(uniSpType)
-    
-    # 4.2 Calculate J-K Color And Add J-K Column
-    data[colNameJK] = data[colNameJ] - data[colNameK]
-    
-    # 4.3 Format Designation Number from Designation Column
-    #     (From "XX XX XX.X +XX XX XX.X" to "XXXX+XXXX")
-    for desigIdx,desig in enumerate(data[colNameDesig]):
-        desig    = ''.join(desig.split())
-        signType = '+'
-        signPos  = desig.find(signType)
-        if signPos == -1:
-            signType = '-'
-            signPos  = desig.find(signType)
-        
-        desigProper = desig[:4] + signType + desig[signPos+1:signPos+5]
-        data[colNameDesig][desigIdx] = desigProper
-    
-    
-    # 5. FILTER DATA BY USER INPUT IN spInput -------------------------------------------
+    # 4. FILTER DATA BY USER INPUT IN spInput -------------------------------------------
     uniqueSpec = False
-    specIdx = []
     if spInput.upper().startswith('L'):
-    # If input is a spectral type, then find all spectra of same spectral type
-        for spIdx,spType in enumerate(data[colNameType]):
-            if spType.upper().startswith(spInput.upper()):
-                specIdx.append(spIdx)
-        if not specIdx:
+    # If input is a spectral type, then find all spectra of same spectral type,
+    # sorted by JKmag value (see catalog.select_type)
+        specIdx = catalog.select_type(data, colNameType, spInput)
+        if len(specIdx) == 0:
             print 'No targets found for given input.'
             if std is False:
                 return
         spTypeInput = spInput.upper()
     else:
     # If input is one single spectrum, then find it
-        for spIdx,spType in enumerate(data[colNameRef]):
-            if str(spType) == spInput.upper():
-                specIdx.append(spIdx)
+        specIdx = [spIdx for spIdx,spRef in enumerate(data[colNameRef]) if str(spRef) == spInput.upper()]
         if not specIdx:
             print 'Requested target not found.'
             if std is False:
@@ -754,26 +724,24 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
             uniqueSpec = True
     
     # Find NIR standard target that matches user's spectral type
-    stdIdx = []
-    for spIdx,spType in enumerate(dataS[colNameNIRS]):
-        if spType.upper().startswith(spTypeInput):
-            stdIdx.append(spIdx)
+    stdIdx = catalog.select_type(dataS, colNameNIRS, spTypeInput)
     
     # Add NIR standard target to list of filtered objects if not there already
     # (It may not be included in first filter because OPT SpT != NIR SpT)
     if not uniqueSpec:
         if dataS[colNameNIRS][stdIdx] != dataS[colNameOPTS][stdIdx]:
-            for spIdx,spRef in enumerate(data[colNameRef]):
-                if spRef == int(dataS[colNameRef][stdIdx][0]):
-                    if spIdx not in specIdx:
-                        specIdx.append(spIdx)
+            for spIdx in numpy.flatnonzero(data[colNameRef] == int(dataS[colNameRef][stdIdx][0])):
+                if spIdx not in specIdx:
+                    # Insert it where it belongs by JKmag value
+                    jkPos   = numpy.searchsorted(data[colNameJK][specIdx], data[colNameJK][spIdx], 'right')
+                    specIdx = numpy.insert(specIdx, jkPos, spIdx)
     
-    # Sort relevant objects by JKmag value
+    # Relevant objects are already sorted by JKmag value (a single spectrum needs no sorting)
     specIdx     = numpy.array(specIdx)
-    specSortIdx = data[colNameJK][specIdx].argsort()
+    specSortIdx = numpy.arange(len(specIdx))
     
     
-    # 6. READ SPECTRAL DATA FROM SPECTRAL FILES ----------------------------------------
+    # 5. READ SPECTRAL DATA FROM SPECTRAL FILES ----------------------------------------
     spectraRaw    = {}.fromkeys(OPTNIR_KEYS) # Used to store the raw data from fits files
     specFilesDict = {}.fromkeys(OPTNIR_KEYS) # Used for reference purposes
     
@@ -811,7 +779,7 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
                 spectraRaw[key] = [spectraRaw[key],]
     
     
-    # 7. GATHER OBJECTS' NAMES----------------------------------------------------------
+    # 6. GATHER OBJECTS' NAMES----------------------------------------------------------
     # Filtered objects
     refs = [None] * len(specSortIdx)
     for idx,spIdx in enumerate(specSortIdx):
@@ -828,7 +796,7 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
     objRef = data[colNameRef][specIdx[specSortIdx]]
     
     
-    #8. SMOOTH SPECTRA -----------------------------------------------------------------
+    #7. SMOOTH SPECTRA -----------------------------------------------------------------
     # Smooth the flux data to a reasonable resolution
     spectraS = {}.fromkeys(OPTNIR_KEYS)
     
@@ -841,7 +809,7 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
     spectraS['NIR'] = tmpSpNIR
     
     
-    # 9. SET LIMITS FOR BANDS AND NORMALIZING SECTIONS----------------------------------
+    # 8. SET LIMITS FOR BANDS AND NORMALIZING SECTIONS----------------------------------
     # Initialize dictionary to store limits
     BAND_LIMS = {}.fromkeys(BANDS_NAMES)
     for bandKey in BANDS_NAMES:
@@ -870,7 +838,7 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
     BAND_LIMS['K'  ]['limN'][1] = 2.39
     
     
-    # 10. SELECT SPECTRAL DATA FOR OPTICAL, J-BAND, H-BAND, & K-BAND--------------------
+    # 9. SELECT SPECTRAL DATA FOR OPTICAL, J-BAND, H-BAND, & K-BAND---------------------
     # Initialize variables
     spectra  = {}.fromkeys(BANDS_NAMES)
     spectraN = {}.fromkeys(BANDS_NAMES)
@@ -881,38 +849,29 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
         else:
             optNIR = 'NIR'
         
-        # Select band
-        spectra[bandKey] = at.sel_band(spectraS[optNIR], BAND_LIMS[bandKey]['lim'], \
+        # Select band (spectra with no data in it are None)
+        spectra[bandKey] = spectools.sel_band(spectraS[optNIR], BAND_LIMS[bandKey]['lim'], \
                                        objRef)
-        if spectra[bandKey] is None:
+        inBand = [spIdx for spIdx, spec in enumerate(spectra[bandKey]) if spec is not None]
+        if not inBand:
             break
         
-        # Normalize band
-        spectraN[bandKey], flagN = at.norm_spec(spectra[bandKey], \
-                                               BAND_LIMS[bandKey]['limN'], flag=True)
+        # Normalize band (only the spectra in it; the rest stay None in their place)
+        tmpNorm, flagN = at.norm_spec([spectra[bandKey][spIdx] for spIdx in inBand], \
+                                      BAND_LIMS[bandKey]['limN'], flag=True)
         if flagN:
             print 'LIMITS for normalization changed!'
-        if spectraN[bandKey] is None:
+        if tmpNorm is None:
             break
+        spectraN[bandKey] = [None] * len(spectra[bandKey])
+        for spIdx, spec in zip(inBand, tmpNorm):
+            spectraN[bandKey][spIdx] = spec
     
-    # 11. CHARACTERIZE TARGETS (i.e. identify young, blue, to exclude...)---------------
+    # 10. CHARACTERIZE TARGETS (i.e. identify young, blue, to exclude...)---------------
     # Determine which targets to exclude using the "Exclude_Objs" file
-    toExclude = [False] * len(refs)
     dataExcl = asciidata.open(FOLDER_ROOT + EXCL_FILE, NULL_CHAR, DELL_CHAR, COMM_CHAR)
-    if len(dataExcl[0]) > 0:
-        # Extract data from "Exclude_Objs" file
-        excludeObjs = [None] * len(dataExcl[0])
-        for rowIdx, rowData in enumerate(dataExcl[0]):
-            excludeObjs[rowIdx] = str(rowData)
-        
-        # Find intersection of exclude-obj list and filtered targets list
-        setExclude = set(excludeObjs).intersection(set(refs))
-        
-        # Create list with intersection targets
-        if len(setExclude) != 0:
-            for exclIdx in setExclude:
-                tmpExclIdx = numpy.where(numpy.array(refs) == exclIdx)
-                toExclude[tmpExclIdx[0]] = True
+    excludeObjs = [str(rowData) for rowData in dataExcl[0]]
+    toExclude = numpy.in1d(numpy.array(refs), excludeObjs)
     
     # Determine which target is the NIR Standard object
     O_standard = [None] * 3 # Holds standard for output
@@ -925,125 +884,15 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
             O_standard[1] = spectraN['H'][idx]
             O_standard[2] = spectraN['K'][idx]
     
-    # Determine which targets are blue
-    blueObjs = [False] * len(refs)
-    for idx,spIdx in enumerate(specIdx[specSortIdx]):
-        if data[colNameBlue][spIdx].upper() == 'YES':
-            blueObjs[idx] = True
-    
-    # Determine which targets are dusty
-    dustyObjs = [False] * len(refs)
-    for idx,spIdx in enumerate(specIdx[specSortIdx]):
-        if data[colNameDust][spIdx].upper() == 'YES':
-            dustyObjs[idx] = True
-    
-    # Determine which targets are binary
-    binObjs = [False] * len(refs)
-    for idx,spIdx in enumerate(specIdx[specSortIdx]):
-        if data[colNameBin][spIdx].upper() == 'YES':
-            binObjs[idx] = True
-    
-    # Determine which targets are peculiar
-    pecObjs = [False] * len(refs)
-    for idx,spIdx in enumerate(specIdx[specSortIdx]):
-        if data[colNamePec][spIdx].upper() == 'YES':
-            pecObjs[idx] = True
-    
-    # Determine which targets are young
-    youngObjs = [False] * len(refs)
-    for idx,spIdx in enumerate(specIdx[specSortIdx]):
-        if data[colNameYng][spIdx].upper() == 'YES':
-            youngObjs[idx] = True
-    
-    # Determine which targets are GAMMA
-    gammaObjs = [False] * len(refs)
-    for idx,spIdx in enumerate(specIdx[specSortIdx]):
-        tmpType = data[colNameType][spIdx].encode('utf-8')
-        tmpLen  = len(tmpType)
-        utcA = tmpType[tmpLen - 2]
-        utcB = tmpType[tmpLen - 1]
-        # GAMMA in utf-8 code is "\xce\xb3"
-        if utcA == '\xce' and utcB == '\xb3':
-            gammaObjs[idx] = True
-    
-    # Determine which targets are BETA
-    betaObjs = [False] * len(refs)
-    for idx,spIdx in enumerate(specIdx[specSortIdx]):
-        tmpType = data[colNameType][spIdx].encode('utf-8')
-        tmpLen  = len(tmpType)
-        utcA = tmpType[tmpLen - 2]
-        utcB = tmpType[tmpLen - 1]
-        # GAMMA in utf-8 code is "\xce\xb2"
-        if utcA == '\xce' and utcB == '\xb2':
-            betaObjs[idx] = True
+    # Flags of each target (young, dusty, blue, binary, peculiar, gamma, beta; see catalog.derive_columns),
+    # plus the flag of the NIR Standard
+    flags = data[catalog.COL_FLAGS][specIdx[specSortIdx]] | numpy.where(stdObjs, catalog.FLAG_STANDARD, 0)
     
     # Determine which targets to include in plots (based on user input)
     # Consolidate plotting & template-flux instructions
     grav = grav.upper()
-    plotInstructions  = ['exclude'] * len(refs)
-    templInstructions = [False] * len(refs)
-    if grav == 'Y': # If plot request is Young, include gamma, beta & young targets
-        for plotIdx in range(len(refs)):
-            if toExclude[plotIdx]:
-                continue
-            if gammaObjs[plotIdx] or betaObjs[plotIdx] or youngObjs[plotIdx]:
-                if blueObjs[plotIdx] or dustyObjs[plotIdx] or pecObjs[plotIdx] \
-                                                           or binObjs[plotIdx]:
-                    continue
-                plotInstructions[plotIdx] = 'young'
-                templInstructions[plotIdx] = True
-    
-    elif grav == 'G': # If plot request is Gamma, include only gamma targets
-        for plotIdx in range(len(plotInstructions)):
-            if toExclude[plotIdx]:
-                continue
-            if gammaObjs[plotIdx]:
-                if blueObjs[plotIdx] or dustyObjs[plotIdx] or pecObjs[plotIdx] \
-                                                           or binObjs[plotIdx]:
-                    continue
-                plotInstructions[plotIdx] = 'young'
-                templInstructions[plotIdx] = True
-    
-    elif grav == 'B': # If plot request is Beta, include only beta targets
-        for plotIdx in range(len(plotInstructions)):
-            if toExclude[plotIdx]:
-                continue
-            if betaObjs[plotIdx]:
-                if blueObjs[plotIdx] or dustyObjs[plotIdx] or pecObjs[plotIdx] \
-                                                           or binObjs[plotIdx]:
-                    continue
-                plotInstructions[plotIdx] = 'young'
-                templInstructions[plotIdx] = True
-    
-    elif grav == 'F': # If plot request is Field, include Field & Standard targets
-        for plotIdx in range(len(plotInstructions)):
-            if toExclude[plotIdx]:
-                continue
-            if betaObjs[plotIdx] or gammaObjs[plotIdx] or youngObjs[plotIdx]:
-                continue
-            if blueObjs[plotIdx] or dustyObjs[plotIdx] or pecObjs[plotIdx] \
-                                                       or binObjs[plotIdx]:
-                continue
-            if stdObjs[plotIdx]:
-                plotInstructions[plotIdx] = 'standard'
-            else:
-                plotInstructions[plotIdx] = 'field'
-            templInstructions[plotIdx] = True
-    
-    else:   # Otherwise, print Field, gamma, beta, young & Standard targets
-        for plotIdx in range(len(plotInstructions)):
-            if toExclude[plotIdx]:
-                continue
-            if blueObjs[plotIdx] or dustyObjs[plotIdx] or pecObjs[plotIdx] \
-                                                       or binObjs[plotIdx]:
-                continue
-            if youngObjs[plotIdx]:
-                plotInstructions[plotIdx] = 'young'
-            elif stdObjs[plotIdx]:
-                plotInstructions[plotIdx] = 'standard'
-            else:
-                plotInstructions[plotIdx] = 'field'
-            templInstructions[plotIdx] = True
+    plotInstructions  = catalog.select_targets(flags, GRAV_RULES.get(grav, GRAV_RULES['']), toExclude)
+    templInstructions = [instr not in ('exclude',) for instr in plotInstructions]
     
     # If all plot instructions are "exclude", then stop procedure (for spectral types)
     allExcl = True
@@ -1058,7 +907,7 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
             return
     
     
-    # 12. CALCULATE TEMPLATE SPECTRA FOR SELECTED SET OF SPECTRA -----------------------
+    # 11. CALCULATE TEMPLATE SPECTRA FOR SELECTED SET OF SPECTRA -----------------------
     # Gather spectra to use to calculate template spectrum
     if not allExcl:
         O_template = [None] * 3 # Holds calculated template for output
@@ -1109,7 +958,7 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
             O_template = None
     
     
-    # 13. PLOT DATA --------------------------------------------------------------------
+    # 12. PLOT DATA --------------------------------------------------------------------
     if lbl or plot:
         # Gather info on each target
         objInfo = [None] * len(refs)
@@ -1130,7 +979,7 @@ def main(spInput, grav='', plot=True, templ=False, std=False, lbl=False):
         
         figObj.savefig(FOLDER_ROOT + FOLDER_OUT + spTypeInput + grav + '.pdf', dpi=600)
     
-    # 14. DETERMINE OUTPUT -------------------------------------------------------------
+    # 13. DETERMINE OUTPUT -------------------------------------------------------------
     if templ:
         if std:
             return O_template, O_standard
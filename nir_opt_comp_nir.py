@@ -504,6 +504,8 @@ def plotspec(specData, bandNames, limits, objID, classType, grav=None, plotInstr
 def main(spInput, grav=''):
     # 1. LOAD RELEVANT MODULES ---------------------------------------------------------
     import astrotools as at
+    import catalog
+    import spectools
     import asciidata
     import pyfits
     import matplotlib.pyplot as plt
@@ -518,7 +520,6 @@ def main(spInput, grav=''):
     OPTNIR_KEYS  = ['OPT', 'NIR']
     BAND_NAME  = ['NIR']
     data       = ''
-    dataRaw    = ''
     specFiles  = ''
     spectraRaw = ''
     spectra    = ''
@@ -531,75 +532,47 @@ def main(spInput, grav=''):
     
     colNameRef   = HDR_FILE_IN[0]
     colNameDesig = HDR_FILE_IN[1]
-    colNameJ     = HDR_FILE_IN[2]
-    colNameK     = HDR_FILE_IN[4]
     colNameJK    = 'J-K'
     colNameType  = HDR_FILE_IN[6]
-    colNameYng   = HDR_FILE_IN[14]
-    colNameDust  = HDR_FILE_IN[15]
-    colNameBlue  = HDR_FILE_IN[16]
-    colNamePec   = HDR_FILE_IN[18]
     
     # For TXT exclude-objects file
     EXCL_FILE = 'Exclude_Objs.txt'   # ASCII file w/ U#s of objects to exclude
     
+    # Targets to plot for each gravity request (see catalog.select_targets): label, flags of which
+    # the target needs at least one (0: any target), flags it must not have
+    NOT_PLOTTED = catalog.FLAG_BLUE | catalog.FLAG_DUSTY | catalog.FLAG_PEC
+    GRAV_RULES  = {'Y': [('young', catalog.FLAG_LOWGRAV, NOT_PLOTTED)],  # gamma, beta & young targets
+                   'G': [('young', catalog.FLAG_GAMMA, NOT_PLOTTED)],    # only gamma targets
+                   'B': [('young', catalog.FLAG_BETA, NOT_PLOTTED)],     # only beta targets
+                   'F': [('field', 0, catalog.FLAG_LOWGRAV | NOT_PLOTTED)], # only field targets
+                   '':  [('young', catalog.FLAG_YOUNG, NOT_PLOTTED),     # field & young targets
+                         ('field', 0, NOT_PLOTTED)]}
+    
     
     # 3. READ DATA FROM INPUT FILES ----------------------------------------------------
     NULL_CHAR = ''   # Null character
     DELL_CHAR = '\t' # Delimiter character
     COMM_CHAR = '#'  # Comment character
     
-    # File with objects (query in Access)
-    dataRaw = asciidata.open(FOLDER_ROOT + FILE_IN, NULL_CHAR, DELL_CHAR, COMM_CHAR)
-    
-    # Store data in a dictionary-type object
-    data = {}.fromkeys(HDR_FILE_IN)
-    for colIdx,colData in enumerate(dataRaw):
-        data[HDR_FILE_IN[colIdx]] = colData.tonumpy()
-    
+    # File with objects (query in Access), with the formatted columns (unicode
+    # Spectral Type-Text, J-K color, "XXXX+XXXX" designations; see catalog.py)
+    data = catalog.load_catalog(FOLDER_ROOT + FILE_IN, HDR_FILE_IN)
     
-    # 4. FORMAT SOME ASCII COLUMNS -----------------------------------------------------
-    # 4.1 Convert into unicode the Spectral Type-Text column
-    uniSpType = [None] * len(data[colNameType])
-    for sIdx,sType in enumerate(data[colNameType]):
-        uniSpType[sIdx] = sType.decode('utf-8')
     
-    data[colNameType] = numpy.array(uniSpType)
-    
-    # 4.2 Calculate J-K Color And Add J-K Column
-    data[colNameJK] = data[colNameJ] - data[colNameK]
-    
-    # 4.3 Format Designation Number from Designation Column
-    for desigIdx,desig in enumerate(data[colNameDesig]):
-        desig = ''.join(desig.split())
-        signType = '+'
-        signPos = desig.find(signType)
-        if signPos == -1:
-            signType = '-'
-            signPos  = desig.find(signType)
-        
-        desigProper = desig[:4] + signType + desig[signPos+1:signPos+5]
-        data[colNameDesig][desigIdx] = desigProper
+    # 4. FILTER DATA BY USER INPUT IN spInput ------------------------------------------
+    # Find all spectra of same spectral type, sorted by JKmag value (see catalog.select_type)
+    specIdx = catalog.select_type(data, colNameType, spInput)
     
-    
-    # 5. FILTER DATA BY USER INPUT IN spInput ------------------------------------------
-    # Find all spectra of same spectral type
-    specIdx = []
-    for spIdx,spType in enumerate(data[colNameType]):
-        if spType.upper().startswith(spInput.upper()):
-            specIdx.append(spIdx)
-    
-    if not specIdx:
+    if len(specIdx) == 0:
         print 'No target found for given input.'
         return
     spTypeInput = spInput.upper()
     
-    # Sort relevant objects by JKmag value
-    specIdx     = numpy.array(specIdx)
-    specSortIdx = data[colNameJK][specIdx].argsort()
+    # Relevant objects are already sorted by JKmag value
+    specSortIdx = numpy.arange(len(specIdx))
     
     
-    # 6. READ SPECTRAL DATA FROM SPECTRAL FILES ----------------------------------------
+    # 5. READ SPECTRAL DATA FROM SPECTRAL FILES ----------------------------------------
     spectraRaw    = {}.fromkeys(OPTNIR_KEYS) # Used to store the raw data from fits files
     specFilesDict = {}.fromkeys(OPTNIR_KEYS) # Used for reference purposes
     
@@ -635,7 +608,7 @@ def main(spInput, grav=''):
                 spectraRaw[key] = [spectraRaw[key],]
     
     
-    # 7. GATHER OBJECTS' NAMES----------------------------------------------------------
+    # 6. GATHER OBJECTS' NAMES----------------------------------------------------------
     # Filtered objects
     refs = [None] * len(specSortIdx)
     for idx,spIdx in enumerate(specSortIdx):
@@ -643,13 +616,13 @@ def main(spInput, grav=''):
         refs[idx] = str(int(tmpRef))
     
     
-    #8. SMOOTH SPECTRA -----------------------------------------------------------------
+    #7. SMOOTH SPECTRA -----------------------------------------------------------------
     # Smooth the flux data to a reasonable resolution
     spectraS = at.smooth_spec(spectraRaw['NIR'], specFile=specFilesDict['NIR'], \
                               winWidth=0)
     
     
-    # 9. SET LIMITS FOR BAND AND NORMALIZING SECTION------------------------------------
+    # 8. SET LIMITS FOR BAND AND NORMALIZING SECTION------------------------------------
     # Initialize dictionary to store limits
     BAND_LIMS = {}.fromkeys(BAND_NAME)
     for bandKey in BAND_NAME:
@@ -666,136 +639,38 @@ def main(spInput, grav=''):
     BAND_LIMS['NIR']['limN'][1] = 1.32
     
     
-    # 10. SELECT SPECTRAL DATA FOR NIR BAND---------------------------------------------
+    # 9. SELECT SPECTRAL DATA FOR NIR BAND----------------------------------------------
     # Initialize variables
     spectraN = {}.fromkeys(BAND_NAME)
     
     # Gather reference numbers of objects
     objRef = data[colNameRef][specIdx[specSortIdx]]
     
-    # Select band
-    spectra = at.sel_band(spectraS, BAND_LIMS['NIR']['lim'], objRef)
+    # Select band (spectra with no data in it are None)
+    spectra = spectools.sel_band(spectraS, BAND_LIMS['NIR']['lim'], objRef)
+    inBand = [spIdx for spIdx, spec in enumerate(spectra) if spec is not None]
     
-    # Normalize band
-    spectraN['NIR'] = at.norm_spec(spectra, BAND_LIMS['NIR']['limN'])
+    # Normalize band (only the spectra in it; the rest stay None in their place)
+    spectraN['NIR'] = [None] * len(spectra)
+    if inBand:
+        tmpNorm = at.norm_spec([spectra[spIdx] for spIdx in inBand], BAND_LIMS['NIR']['limN'])
+        for spIdx, spec in zip(inBand, tmpNorm):
+            spectraN['NIR'][spIdx] = spec
     
     
-    # 11. CHARACTERIZE TARGETS (i.e. identify young, blue, to exclude...)---------------
+    # 10. CHARACTERIZE TARGETS (i.e. identify young, blue, to exclude...)---------------
     # Determine which targets to exclude using the "Exclude_Objs" file
-    toExclude = [False] * len(refs)
     dataExcl = asciidata.open(FOLDER_ROOT + EXCL_FILE, NULL_CHAR, DELL_CHAR, COMM_CHAR)
-    if len(dataExcl[0]) > 0:
-        # Extract data from "Exclude_Objs" file
-        excludeObjs = [None] * len(dataExcl[0])
-        for rowIdx, rowData in enumerate(dataExcl[0]):
-            excludeObjs[rowIdx] = str(rowData)
-        
-        # Find intersection of exclude-obj list and filtered targets list
-        setExclude = set(excludeObjs).intersection(set(refs))
-        
-        # Create list with intersection targets
-        if len(setExclude) != 0:
-            for exclIdx in setExclude:
-                tmpExclIdx = numpy.where(numpy.array(refs) == exclIdx)
-                toExclude[tmpExclIdx[0]] = True
-    
-    # Determine which targets are blue
-    blueObjs = [False] * len(refs)
-    for idx,spIdx in enumerate(specIdx[specSortIdx]):
-        if data[colNameBlue][spIdx].upper() == 'YES':
-            blueObjs[idx] = True
-    
-    # Determine which targets are dusty
-    dustyObjs = [False] * len(refs)
-    for idx,spIdx in enumerate(specIdx[specSortIdx]):
-        if data[colNameDust][spIdx].upper() == 'YES':
-            dustyObjs[idx] = True
-    
-    # Determine which targets are peculiar
-    pecObjs = [False] * len(refs)
-    for idx,spIdx in enumerate(specIdx[specSortIdx]):
-        if data[colNamePec][spIdx].upper() == 'YES':
-            pecObjs[idx] = True
-    
-    # Determine which plots are young objects
-    youngObjs = [False] * len(refs)
-    for idx,spIdx in enumerate(specSortIdx):
-        if data[colNameYng][specIdx[spIdx]].upper() == 'YES':
-            youngObjs[idx] = True
-    
-    # Determine which targets are GAMMA
-    gammaObjs = [False] * len(refs)
-    for idx,spIdx in enumerate(specIdx[specSortIdx]):
-        tmpType = data[colNameType][spIdx].encode('utf-8')
-        tmpLen  = len(tmpType)
-        utcA = tmpType[tmpLen - 2]
-        utcB = tmpType[tmpLen - 1]
-        # GAMMA in utf-8 code is "\xce\xb3"
-        if utcA == '\xce' and utcB == '\xb3':
-            gammaObjs[idx] = True
-    
-    # Determine which targets are BETA
-    betaObjs = [False] * len(refs)
-    for idx,spIdx in enumerate(specIdx[specSortIdx]):
-        tmpType = data[colNameType][spIdx].encode('utf-8')
-        tmpLen  = len(tmpType)
-        utcA = tmpType[tmpLen - 2]
-        utcB = tmpType[tmpLen - 1]
-        # GAMMA in utf-8 code is "\xce\xb2"
-        if utcA == '\xce' and utcB == '\xb2':
-            betaObjs[idx] = True
+    excludeObjs = [str(rowData) for rowData in dataExcl[0]]
+    toExclude = numpy.in1d(numpy.array(refs), excludeObjs)
+    
+    # Flags of each target (young, dusty, blue, binary, peculiar, gamma, beta; see catalog.derive_columns)
+    flags = data[catalog.COL_FLAGS][specIdx[specSortIdx]]
     
     # Determine which targets to include in plots (based on user input)
     # Consolidate plotting instructions
     grav = grav.upper()
-    plotInstructions = ['exclude'] * len(refs)
-    if grav == 'Y': # If plot request is Young, include gamma, beta & young targets
-        for plotIdx in range(len(refs)):
-            if toExclude[plotIdx]:
-                continue
-            if gammaObjs[plotIdx] or betaObjs[plotIdx] or youngObjs[plotIdx]:
-                if blueObjs[plotIdx] or dustyObjs[plotIdx] or pecObjs[plotIdx]:
-                    continue
-                plotInstructions[plotIdx] = 'young'
-    
-    elif grav == 'G': # If plot request is Gamma, include only gamma targets
-        for plotIdx in range(len(plotInstructions)):
-            if toExclude[plotIdx]:
-                continue
-            if gammaObjs[plotIdx]:
-                if blueObjs[plotIdx] or dustyObjs[plotIdx] or pecObjs[plotIdx]:
-                    continue
-                plotInstructions[plotIdx] = 'young'
-    
-    elif grav == 'B': # If plot request is Beta, include only beta targets
-        for plotIdx in range(len(plotInstructions)):
-            if toExclude[plotIdx]:
-                continue
-            if betaObjs[plotIdx]:
-                if blueObjs[plotIdx] or dustyObjs[plotIdx] or pecObjs[plotIdx]:
-                    continue
-                plotInstructions[plotIdx] = 'young'
-    
-    elif grav == 'F': # If plot request is Field, include Field & Standard targets
-        for plotIdx in range(len(plotInstructions)):
-            if toExclude[plotIdx]:
-                continue
-            if betaObjs[plotIdx] or gammaObjs[plotIdx] or youngObjs[plotIdx]:
-                continue
-            if blueObjs[plotIdx] or dustyObjs[plotIdx] or pecObjs[plotIdx]:
-                continue
-            plotInstructions[plotIdx] = 'field'
-    
-    else:   # Otherwise, print Field, gamma, beta, young & Standard targets
-        for plotIdx in range(len(plotInstructions)):
-            if toExclude[plotIdx]:
-                continue
-            if blueObjs[plotIdx] or dustyObjs[plotIdx] or pecObjs[plotIdx]:
-                continue
-            if youngObjs[plotIdx]:
-                plotInstructions[plotIdx] = 'young'
-            else:
-                plotInstructions[plotIdx] = 'field'
+    plotInstructions = catalog.select_targets(flags, GRAV_RULES.get(grav, GRAV_RULES['']), toExclude)
     
     # If all plot instructions are "exclude", then stop procedure
     allExcl = True
@@ -808,7 +683,7 @@ def main(spInput, grav=''):
             return
     
     
-    # 12. PLOT DATA --------------------------------------------------------------------
+    # 11. PLOT DATA --------------------------------------------------------------------
     # Gather info on each object (for legend purposes)
     objInfo = [None] * len(refs)
     for posIdx,spIdx in enumerate(specIdx[specSortIdx]):
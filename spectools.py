@@ -0,0 +1,203 @@
+'''
+Small spectrum utilities shared by the procedures in this folder. Spectra are handled as separate arrays of
+wavelength, flux, and flux uncertainty, with wavelength sorted in increasing order.
+'''
+
+import numpy
+
+C_KMS = 299792.458 # Speed of light in km/s
+
+
+def log_grid(wv_min, wv_max, n_pix, oversample=1):
+    '''
+    This function returns a wavelength scale that is uniform in ln(wavelength).
+
+    *wv_min*, *wv_max*
+      Float numbers with the first and last wavelengths of the scale.
+    *n_pix*
+      Integer with the number of pixels of the original spectrum covering that range.
+    *oversample*
+      Integer, the scale has n_pix * oversample points.
+    '''
+
+    return numpy.exp(numpy.linspace(numpy.log(wv_min), numpy.log(wv_max), n_pix * oversample))
+
+
+def kms_per_pixel(wv_log):
+    '''
+    This function returns the velocity step (km/s) between consecutive points of a scale built with log_grid.
+    '''
+
+    return C_KMS * (numpy.log(wv_log[-1]) - numpy.log(wv_log[0])) / (len(wv_log) - 1)
+
+
+def resample(wv, fx, sig, wv_new):
+    '''
+    This function linearly interpolates a spectrum onto a new wavelength scale and propagates its uncertainties.
+    Each new point is (1 - t) * fx[i] + t * fx[i+1], so its uncertainty is sqrt((1 - t)**2 * sig[i]**2 + t**2 * sig[i+1]**2).
+    Beyond the ends of *wv*, the first or last point is repeated (as in numpy.interp).
+
+    *wv*, *fx*, *sig*
+      Arrays with the wavelength, flux, and flux uncertainty of the spectrum.
+    *wv_new*
+      Array with the new wavelength scale.
+
+    Returns the flux and flux uncertainty on *wv_new*.
+    '''
+
+    wv = numpy.asarray(wv, dtype=float)
+    fx = numpy.asarray(fx, dtype=float)
+    sig = numpy.asarray(sig, dtype=float)
+
+    idx, frac = interp_weights(wv, wv_new)
+    fx_new = interp_stack(fx, idx, frac)
+    sig_new = numpy.sqrt(((1 - frac) * sig[idx]) ** 2 + (frac * sig[idx + 1]) ** 2)
+
+    return fx_new, sig_new
+
+
+def interp_weights(wv, wv_new):
+    '''
+    This function returns the weights of the linear interpolation used by resample: the index i of the left neighbour of
+    every new point in *wv*, and its fractional distance t to the right neighbour (clipped to the ends of *wv*).
+
+    *wv*
+      Array with the wavelength scale of the spectrum.
+    *wv_new*
+      Array with the new wavelength scale.
+    '''
+
+    wv = numpy.asarray(wv, dtype=float)
+    idx = numpy.clip(numpy.searchsorted(wv, wv_new) - 1, 0, len(wv) - 2)
+    frac = numpy.clip((wv_new - wv[idx]) / (wv[idx + 1] - wv[idx]), 0, 1)
+
+    return idx, frac
+
+
+def interp_stack(fx, idx, frac):
+    '''
+    This function linearly interpolates one spectrum, or a stack of spectra (one per row), with the weights returned by
+    interp_weights. Noise drawn on the original pixels and interpolated this way keeps the correlation between
+    neighbouring new points, which resample cannot carry in its uncertainties.
+
+    *fx*
+      Array with the flux of one spectrum, or 2-D array with one spectrum per row.
+    *idx*, *frac*
+      Arrays returned by interp_weights.
+    '''
+
+    fx = numpy.asarray(fx, dtype=float)
+
+    return (1 - frac) * fx[..., idx] + frac * fx[..., idx + 1]
+
+
+def log_resample(wv, fx, sig, oversample=1, wv_min=None, wv_max=None):
+    '''
+    This function maps a spectrum directly onto a ln(wavelength) scale with *oversample* times as many points as the
+    spectrum, in one interpolation step (see resample).
+
+    *wv*, *fx*, *sig*
+      Arrays with the wavelength, flux, and flux uncertainty of the spectrum.
+    *oversample*
+      Integer, oversampling factor of the new scale.
+    *wv_min*, *wv_max*
+      Float numbers with the range of the new scale (default: the range of *wv*).
+
+    Returns the new wavelength scale, flux, and flux uncertainty.
+    '''
+
+    if wv_min is None:
+        wv_min = numpy.min(wv)
+    if wv_max is None:
+        wv_max = numpy.max(wv)
+
+    wv_log = log_grid(wv_min, wv_max, len(wv), oversample)
+    fx_log, sig_log = resample(wv, fx, sig, wv_log)
+
+    return wv_log, fx_log, sig_log
+
+
+def shift_spec(fx, shift, method='fourier', fill=1.):
+    '''
+    This function shifts one spectrum, or a stack of spectra (one per row), by a fractional number of pixels. On a
+    ln(wavelength) scale this is a shift in velocity (see kms_per_pixel).
+
+    *fx*
+      Array with the flux of one spectrum, or 2-D array with one spectrum per row.
+    *shift*
+      Float number of pixels to shift by (positive moves features to larger wavelengths), or one per row of *fx*.
+    *method*
+      String, 'fourier' to apply the shift as a phase ramp (Fourier shift theorem), 'interp' to interpolate linearly.
+    *fill*
+      Float number used for the pixels shifted in from beyond the ends of the spectrum.
+    '''
+
+    fx = numpy.asarray(fx, dtype=float)
+    stack = numpy.atleast_2d(fx)
+    n_pix = stack.shape[1]
+    shift = numpy.broadcast_to(numpy.asarray(shift, dtype=float), (stack.shape[0],))[:, numpy.newaxis]
+
+    if method == 'fourier':
+        # Pad with the fill value beyond the largest shift so that the phase ramp does not wrap spectra around
+        nfft = n_pix + int(numpy.ceil(numpy.abs(shift).max())) + 1
+        freqs = numpy.fft.rfftfreq(nfft)
+        ft = numpy.fft.rfft(stack - fill, nfft, axis=1)
+        shifted = numpy.fft.irfft(ft * numpy.exp(-2j * numpy.pi * freqs * shift), nfft, axis=1)[:, :n_pix] + fill
+    elif method == 'interp':
+        pos = numpy.arange(n_pix) - shift
+        left = numpy.clip(numpy.floor(pos).astype(int), 0, n_pix - 2)
+        frac = pos - left
+        rows = numpy.arange(stack.shape[0])[:, numpy.newaxis]
+        shifted = (1 - frac) * stack[rows, left] + frac * stack[rows, left + 1]
+        shifted[(pos < 0) | (pos > n_pix - 1)] = fill
+    else:
+        raise ValueError('Unknown shift method: %s' %(method))
+
+    if fx.ndim == 1:
+        return shifted[0]
+    return shifted
+
+
+def band_slice(wv, lim):
+    '''
+    This function returns the slice of a wavelength array that falls inside a band, found by binary search (the
+    wavelength must be sorted in increasing order).  Indexing a spectrum with it gives a view, not a copy.
+
+    *wv*
+      Array with the wavelength of the spectrum.
+    *lim*
+      Sequence with the two float numbers limiting the band (both included).
+    '''
+
+    return slice(numpy.searchsorted(wv, lim[0], 'left'), numpy.searchsorted(wv, lim[1], 'right'))
+
+
+def sel_band(specData, lim, objID=None):
+    '''
+    This function cuts every spectrum in a list to a band (see band_slice). Spectra are 2-D arrays with wavelength in
+    the first row, or sequences of arrays with wavelength first; the result holds views of them, so nothing is copied.
+    Spectra that are None, or that have no data in the band, are None in the result.
+
+    *specData*
+      List of spectra.
+    *lim*
+      Sequence with the two float numbers limiting the band.
+    *objID*
+      List with the names of the spectra, used in the message for spectra with no data in the band.
+    '''
+
+    selected = [None] * len(specData)
+    for spIdx, spec in enumerate(specData):
+        if spec is None:
+            continue
+        sl = band_slice(spec[0], lim)
+        if sl.start == sl.stop:
+            if objID is not None:
+                print 'No data in band ' + str(list(lim)) + ' for object ' + str(objID[spIdx])
+            continue
+        if isinstance(spec, numpy.ndarray):
+            selected[spIdx] = spec[:, sl]
+        else:
+            selected[spIdx] = [row[sl] for row in spec]
+
+    return selected